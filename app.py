@@ -1,35 +1,202 @@
+import atexit
+import cProfile
+import hashlib
+import heapq
+import hmac
+import io
+import json
 import os
+import pstats
+import random
+import re
 import sqlite3
 import secrets
 import string
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, date, timedelta
 
-import requests
-import stripe
-from flask import Flask, jsonify, redirect, render_template, request, session, url_for, flash
+import click
+from flask import Flask, g, has_app_context, has_request_context, jsonify, redirect, render_template, request, send_from_directory, session, url_for, flash
 from werkzeug.security import check_password_hash, generate_password_hash
 from werkzeug.utils import secure_filename
 
-app = Flask(__name__)
-app.secret_key = os.environ.get("FLASK_SECRET", "super-secret-key")
-app.config["UPLOAD_FOLDER"] = os.path.join(app.root_path, "static", "uploads")
-os.makedirs(app.config["UPLOAD_FOLDER"], exist_ok=True)
+import integrations
 
-DATABASE = os.path.join(app.root_path, "kimq.db")
+app = Flask(__name__)
+app.config.from_mapping(
+    SECRET_KEY=os.environ.get("FLASK_SECRET", "super-secret-key"),
+    DATABASE=os.environ.get("KIMQ_DATABASE", os.path.join(app.root_path, "kimq.db")),
+    UPLOAD_FOLDER=os.path.join(app.root_path, "static", "uploads"),
+    AUTO_MIGRATE=os.environ.get("AUTO_MIGRATE", "1") != "0",
+    SQL_SLOW_QUERY_MS=float(os.environ.get("SQL_SLOW_QUERY_MS", "100")),
+    SQL_QUERY_BUDGET=int(os.environ.get("SQL_QUERY_BUDGET", "50")),
+    METRICS_TOKEN=os.environ.get("METRICS_TOKEN"),
+    PROFILE_DIR=os.environ.get("PROFILE_DIR", os.path.join(app.root_path, "profiles")),
+    PROFILE_MAX_FILES=int(os.environ.get("PROFILE_MAX_FILES", "50")),
+    PROFILE_SAMPLE_RATE=float(os.environ.get("PROFILE_SAMPLE_RATE", "0")),
+    # How "any artist" bookings are assigned: least_booked, round_robin or preferred.
+    ANY_ARTIST_POLICY=os.environ.get("ANY_ARTIST_POLICY", "least_booked"),
+    # Employee ids tried first under the "preferred" policy.
+    ANY_ARTIST_PREFERRED=[int(v) for v in os.environ.get("ANY_ARTIST_PREFERRED", "").split(",") if v.strip()],
+)
+
+if os.environ.get("LOG_LEVEL"):
+    app.logger.setLevel(os.environ["LOG_LEVEL"].upper())
 
 
 # ---------- Database helpers ----------
 
-def get_db():
-    conn = sqlite3.connect(DATABASE)
+class InstrumentedConnection(sqlite3.Connection):
+    """Connection that counts and times statements for the request that opened it.
+
+    Timing covers running a statement up to its first row, which is where
+    SQLite does the index lookups and sorts; rows fetched afterwards are not
+    included.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.query_count = 0
+        self.query_seconds = 0.0
+        self.slowest = (0.0, None)
+
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self.record_query(sql, parameters, time.perf_counter() - started)
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self.record_query(sql, None, time.perf_counter() - started)
+
+    def record_query(self, sql, parameters, seconds):
+        self.query_count += 1
+        self.query_seconds += seconds
+        if seconds > self.slowest[0]:
+            self.slowest = (seconds, sql)
+        if seconds * 1000 >= app.config["SQL_SLOW_QUERY_MS"]:
+            log_slow_query(self, sql, parameters, seconds)
+
+
+def compact_sql(sql, limit=300):
+    sql = " ".join(sql.split())
+    return sql if len(sql) <= limit else sql[: limit - 3] + "..."
+
+
+def log_slow_query(conn, sql, parameters, seconds):
+    """Log a statement over SQL_SLOW_QUERY_MS with the endpoint that ran it and its query plan."""
+    endpoint = request.endpoint if has_request_context() else None
+    plan = []
+    if parameters is not None and sql.lstrip().upper().startswith(("SELECT", "WITH", "UPDATE", "DELETE", "INSERT")):
+        try:
+            rows = sqlite3.Connection.execute(conn, "EXPLAIN QUERY PLAN " + sql, parameters).fetchall()
+            plan = [row[3] for row in rows]
+        except sqlite3.Error as exc:
+            plan = [f"(plan unavailable: {exc})"]
+    app.logger.warning(
+        "slow query %.1f ms in %s: %s | plan: %s",
+        seconds * 1000,
+        endpoint or "(no request)",
+        compact_sql(sql),
+        "; ".join(plan) or "-",
+    )
+
+
+_schema_lock = threading.Lock()
+_schema_ready = threading.Event()
+
+
+def ensure_schema():
+    """Check (and if needed migrate) the schema once per process, on first connection."""
+    with _schema_lock:
+        if not _schema_ready.is_set():
+            init_db()
+            _schema_ready.set()
+
+
+def connect_db(instrumented=False):
+    if not _schema_ready.is_set():
+        ensure_schema()
+    return open_db(instrumented)
+
+
+def open_db(instrumented=False):
+    conn = sqlite3.connect(
+        app.config["DATABASE"], timeout=5, factory=InstrumentedConnection if instrumented else sqlite3.Connection
+    )
     conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA busy_timeout = 5000")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute("PRAGMA cache_size = -16000")
+    if instrumented:
+        conn.reset_stats()
     return conn
 
 
-def init_db():
-    conn = get_db()
+def get_db():
+    """Return the request's connection, opening it on first use.
+
+    Outside an app context (init_db, scripts) a standalone connection is
+    returned and the caller closes it.
+    """
+    if not has_app_context():
+        return connect_db()
+    if "db" not in g:
+        g.db = connect_db(instrumented=True)
+    return g.db
+
+
+@app.after_request
+def report_sql_usage(response):
+    """Summarize the request's SQL in a Server-Timing header and the app log.
+
+    Requests issuing more than SQL_QUERY_BUDGET statements are logged as
+    warnings, which is how per-row query loops show up.
+    """
+    conn = g.get("db")
+    if isinstance(conn, InstrumentedConnection) and conn.query_count:
+        db_ms = conn.query_seconds * 1000
+        response.headers.add("Server-Timing", f'db;dur={db_ms:.1f};desc="{conn.query_count} queries"')
+        log = app.logger.warning if conn.query_count > app.config["SQL_QUERY_BUDGET"] else app.logger.info
+        log(
+            "%s %s: %d queries, %.1f ms in SQLite, slowest %.1f ms: %s",
+            request.method,
+            request.endpoint,
+            conn.query_count,
+            db_ms,
+            conn.slowest[0] * 1000,
+            compact_sql(conn.slowest[1] or "", 120),
+        )
+    return response
+
+
+@app.teardown_appcontext
+def close_db(exc):
+    conn = g.pop("db", None)
+    if conn is not None:
+        conn.close()
+
+
+# ---------- Schema migrations ----------
+
+def table_columns(conn, table):
+    return {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+
+
+def migrate_base_schema(conn):
+    """Original tables, columns added to services/appointments since launch, canonical datetimes and indexes."""
     cur = conn.cursor()
-    cur.execute("PRAGMA foreign_keys = ON;")
     cur.execute(
         """
         CREATE TABLE IF NOT EXISTS users (
@@ -82,6 +249,7 @@ def init_db():
             service_id INTEGER,
             employee_id INTEGER,
             start_time TEXT,
+            end_time TEXT,
             status TEXT,
             notes TEXT,
             payment_intent_id TEXT,
@@ -193,11 +361,9 @@ def init_db():
         );
         """
     )
-    try:
-        cur.execute("ALTER TABLE services ADD COLUMN image_url TEXT")
-    except sqlite3.OperationalError:
-        pass
+    services_columns = table_columns(conn, "services")
     for column, default in [
+        ("image_url", None),
         ("category", "Bridal"),
         ("calendar_color", "#f9b5d0"),
         ("duration_minutes", 90),
@@ -205,21 +371,377 @@ def init_db():
         ("block_minutes", 0),
         ("require_deposit", 1),
     ]:
-        try:
-            cur.execute(
-                f"ALTER TABLE services ADD COLUMN {column} {'INTEGER' if 'minutes' in column or column=='require_deposit' else 'TEXT'}"
-            )
+        if column in services_columns:
+            continue
+        cur.execute(
+            f"ALTER TABLE services ADD COLUMN {column} {'INTEGER' if 'minutes' in column or column=='require_deposit' else 'TEXT'}"
+        )
+        if default is not None:
             cur.execute(f"UPDATE services SET {column}=?", (default,))
-        except sqlite3.OperationalError:
-            pass
-    conn.commit()
+    if "end_time" not in table_columns(conn, "appointments"):
+        cur.execute("ALTER TABLE appointments ADD COLUMN end_time TEXT")
+        cur.execute(
+            """
+            UPDATE appointments SET end_time = strftime('%Y-%m-%dT%H:%M:%S', start_time, '+' || COALESCE(
+                (SELECT NULLIF(COALESCE(s.duration_minutes, 0) + COALESCE(s.processing_minutes, 0) + COALESCE(s.block_minutes, 0), 0)
+                 FROM services s WHERE s.id = appointments.service_id),
+                60
+            ) || ' minutes')
+            """
+        )
+    # Store every appointment/time-off bound as 'YYYY-MM-DDTHH:MM:SS' so the
+    # hot queries can compare raw columns and use the indexes below.
+    for table in ("appointments", "time_off"):
+        cur.execute(
+            f"""
+            UPDATE {table}
+            SET start_time = COALESCE(strftime('%Y-%m-%dT%H:%M:%S', start_time), start_time),
+                end_time = COALESCE(strftime('%Y-%m-%dT%H:%M:%S', end_time), end_time)
+            """
+        )
+    for statement in [
+        "CREATE INDEX IF NOT EXISTS idx_appointments_employee_start ON appointments (employee_id, start_time)",
+        "CREATE INDEX IF NOT EXISTS idx_appointments_start ON appointments (start_time)",
+        "CREATE INDEX IF NOT EXISTS idx_appointments_client_start ON appointments (client_id, start_time)",
+        "CREATE INDEX IF NOT EXISTS idx_time_off_employee_end ON time_off (employee_id, end_time)",
+        "CREATE INDEX IF NOT EXISTS idx_availability_employee_weekday ON availability (employee_id, weekday)",
+        "CREATE INDEX IF NOT EXISTS idx_payments_client_email_created ON payments (client_email, created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_clients_email ON clients (email)",
+        "CREATE INDEX IF NOT EXISTS idx_clients_created ON clients (created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_client_notes_client_created ON client_notes (client_id, created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_client_photos_client_created ON client_photos (client_id, created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_gift_cards_created ON gift_cards (created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_password_resets_user ON password_resets (user_id)",
+    ]:
+        cur.execute(statement)
     seed_users(conn)
     seed_services(conn)
     seed_availability(conn)
     seed_settings(conn)
-    conn.close()
 
 
+def migrate_email_outbox(conn):
+    cur = conn.cursor()
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS email_outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            to_email TEXT NOT NULL,
+            subject TEXT NOT NULL,
+            body TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%S', 'now')),
+            last_error TEXT,
+            sent_at TEXT,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP
+        );
+        """
+    )
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_email_outbox_due ON email_outbox (status, next_attempt_at)")
+
+
+def migrate_occupancy(conn):
+    cur = conn.cursor()
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS occupancy_days (
+            employee_id INTEGER NOT NULL,
+            day TEXT NOT NULL,
+            busy BLOB NOT NULL,
+            time_off BLOB NOT NULL,
+            PRIMARY KEY (employee_id, day)
+        );
+        """
+    )
+    rebuild_occupancy(conn)
+
+
+def migrate_runtime_tables(conn):
+    """Tables added before they were versioned; databases already at 3 may have some of them."""
+    cur = conn.cursor()
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS slot_holds (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            employee_id INTEGER NOT NULL,
+            start_time TEXT NOT NULL,
+            end_time TEXT NOT NULL,
+            expires_at TEXT NOT NULL,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE (employee_id, start_time),
+            FOREIGN KEY(employee_id) REFERENCES users(id)
+        );
+        """
+    )
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS feed_cache (
+            key TEXT PRIMARY KEY,
+            payload TEXT,
+            fetched_at TEXT,
+            refresh_after TEXT NOT NULL
+        );
+        """
+    )
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS log_offsets (
+            path TEXT PRIMARY KEY,
+            inode INTEGER,
+            byte_offset INTEGER NOT NULL DEFAULT 0,
+            updated_at TEXT DEFAULT CURRENT_TIMESTAMP
+        );
+        """
+    )
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS access_log_hits (
+            day TEXT NOT NULL,
+            path TEXT NOT NULL,
+            hits INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, path)
+        );
+        """
+    )
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS metric_samples (
+            name TEXT NOT NULL,
+            labels TEXT NOT NULL,
+            value REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (name, labels)
+        );
+        """
+    )
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS metric_gauges (
+            pid INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            labels TEXT NOT NULL,
+            value REAL NOT NULL DEFAULT 0,
+            updated_at TEXT NOT NULL,
+            PRIMARY KEY (pid, name, labels)
+        );
+        """
+    )
+
+
+def migrate_outbox_channels(conn):
+    # SMS rows reuse the outbox; their to_email column holds the phone number.
+    if "channel" not in table_columns(conn, "email_outbox"):
+        conn.execute("ALTER TABLE email_outbox ADD COLUMN channel TEXT NOT NULL DEFAULT 'email'")
+
+
+def migrate_appointment_reminders(conn):
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS appointment_reminders (
+            appointment_id INTEGER NOT NULL,
+            kind TEXT NOT NULL,
+            channel TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'sending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            run_token TEXT,
+            claimed_at TEXT,
+            sent_at TEXT,
+            last_error TEXT,
+            PRIMARY KEY (appointment_id, kind, channel),
+            FOREIGN KEY(appointment_id) REFERENCES appointments(id)
+        ) WITHOUT ROWID;
+        """
+    )
+
+
+def migrate_stripe_events(conn):
+    columns = table_columns(conn, "payments")
+    if "submission_token" not in columns:
+        conn.execute("ALTER TABLE payments ADD COLUMN submission_token TEXT")
+    if "stripe_event_at" not in columns:
+        conn.execute("ALTER TABLE payments ADD COLUMN stripe_event_at INTEGER")
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS stripe_events (
+            id TEXT PRIMARY KEY,
+            type TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            last_error TEXT,
+            received_at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%S', 'now')),
+            next_attempt_at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%S', 'now')),
+            processed_at TEXT
+        );
+        """
+    )
+    for statement in [
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_payments_submission_token ON payments (submission_token)",
+        "CREATE INDEX IF NOT EXISTS idx_payments_intent ON payments (payment_intent_id)",
+        "CREATE INDEX IF NOT EXISTS idx_appointments_payment_intent ON appointments (payment_intent_id)",
+        "CREATE INDEX IF NOT EXISTS idx_gift_cards_payment_intent ON gift_cards (payment_intent_id)",
+        "CREATE INDEX IF NOT EXISTS idx_stripe_events_due ON stripe_events (status, next_attempt_at)",
+    ]:
+        conn.execute(statement)
+
+
+def phone_digits_sql(column):
+    """SQL for ``column`` with common phone punctuation removed, so "3135550100" finds "(313) 555-0100"."""
+    expr = f"COALESCE({column}, '')"
+    for char in "()-. +":
+        expr = f"replace({expr}, '{char}', '')"
+    return expr
+
+
+def email_local_part_sql(column):
+    # Only the part before "@" is indexed: a shared domain like gmail.com
+    # would otherwise match (and rank) most of the table.
+    return f"substr(COALESCE({column}, ''), 1, instr(COALESCE({column}, '') || '@', '@') - 1)"
+
+
+def migrate_client_search(conn):
+    cur = conn.cursor()
+    # rowid is the client id; note_text holds every client_notes.note for the client.
+    cur.execute(
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS client_search USING fts5(
+            name, email, phone, notes, note_text,
+            tokenize = 'unicode61 remove_diacritics 2',
+            prefix = '2 3 4'
+        );
+        """
+    )
+    cur.execute("INSERT INTO client_search (client_search, rank) VALUES ('rank', 'bm25(10.0, 4.0, 4.0, 1.0, 1.0)')")
+    new_phone = f"COALESCE(NEW.phone, '') || ' ' || {phone_digits_sql('NEW.phone')}"
+    notes_of = "(SELECT COALESCE(group_concat(note, ' '), '') FROM client_notes WHERE client_id={})"
+    # One execute per trigger: executescript would commit apply_migrations' transaction.
+    for statement in [
+        f"""
+        CREATE TRIGGER IF NOT EXISTS clients_search_insert AFTER INSERT ON clients BEGIN
+            INSERT INTO client_search (rowid, name, email, phone, notes, note_text)
+            VALUES (NEW.id, NEW.name, {email_local_part_sql('NEW.email')}, {new_phone}, NEW.notes, {notes_of.format('NEW.id')});
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS clients_search_update AFTER UPDATE OF name, email, phone, notes ON clients BEGIN
+            UPDATE client_search SET name=NEW.name, email={email_local_part_sql('NEW.email')}, phone={new_phone}, notes=NEW.notes
+            WHERE rowid=NEW.id;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS clients_search_delete AFTER DELETE ON clients BEGIN
+            DELETE FROM client_search WHERE rowid=OLD.id;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS client_notes_search_insert AFTER INSERT ON client_notes BEGIN
+            UPDATE client_search SET note_text = note_text || ' ' || COALESCE(NEW.note, '') WHERE rowid=NEW.client_id;
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS client_notes_search_update AFTER UPDATE OF client_id, note ON client_notes BEGIN
+            UPDATE client_search SET note_text = {notes_of.format('OLD.client_id')} WHERE rowid=OLD.client_id;
+            UPDATE client_search SET note_text = {notes_of.format('NEW.client_id')} WHERE rowid=NEW.client_id;
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS client_notes_search_delete AFTER DELETE ON client_notes BEGIN
+            UPDATE client_search SET note_text = {notes_of.format('OLD.client_id')} WHERE rowid=OLD.client_id;
+        END
+        """,
+    ]:
+        cur.execute(statement)
+    cur.execute(
+        f"""
+        INSERT INTO client_search (rowid, name, email, phone, notes, note_text)
+        SELECT c.id, c.name, {email_local_part_sql('c.email')}, COALESCE(c.phone, '') || ' ' || {phone_digits_sql('c.phone')}, c.notes,
+               COALESCE(n.note_text, '')
+        FROM clients c
+        LEFT JOIN (SELECT client_id, group_concat(note, ' ') AS note_text FROM client_notes GROUP BY client_id) n
+            ON n.client_id = c.id
+        """
+    )
+
+
+def migrate_payment_listing(conn):
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_payments_created ON payments (created_at)")
+
+
+def migrate_hold_submissions(conn):
+    if "submission_token" not in table_columns(conn, "slot_holds"):
+        conn.execute("ALTER TABLE slot_holds ADD COLUMN submission_token TEXT")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_slot_holds_submission_token ON slot_holds (submission_token)")
+
+
+MIGRATIONS = [
+    (1, "base schema, canonical datetimes and indexes", migrate_base_schema),
+    (2, "email outbox", migrate_email_outbox),
+    (3, "occupancy bitmaps", migrate_occupancy),
+    (4, "slot holds, feed cache, log aggregates and metrics", migrate_runtime_tables),
+    (5, "outbox channels", migrate_outbox_channels),
+    (6, "appointment reminders", migrate_appointment_reminders),
+    (7, "stripe idempotency and webhook events", migrate_stripe_events),
+    (8, "client full-text search", migrate_client_search),
+    (9, "payments listing index", migrate_payment_listing),
+    (10, "slot hold submission tokens", migrate_hold_submissions),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def apply_migrations(conn):
+    """Run every step newer than PRAGMA user_version in one transaction; returns the versions applied."""
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        # Re-read under the write lock in case another worker migrated first.
+        current = conn.execute("PRAGMA user_version").fetchone()[0]
+        applied = []
+        for version, _, step in MIGRATIONS:
+            if version > current:
+                step(conn)
+                applied.append(version)
+        if applied:
+            conn.execute(f"PRAGMA user_version = {applied[-1]}")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return applied
+
+
+def init_db():
+    """Bring the schema up to date; an up-to-date database costs one pragma read."""
+    conn = open_db()
+    try:
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        if version >= SCHEMA_VERSION:
+            return
+        if app.config["AUTO_MIGRATE"]:
+            apply_migrations(conn)
+        else:
+            app.logger.warning("schema is at version %d of %d; run flask --app app migrate-db", version, SCHEMA_VERSION)
+    finally:
+        conn.close()
+
+
+@app.cli.command("migrate-db")
+@click.option("--status", is_flag=True, help="Only report the current version and pending steps.")
+def migrate_db_command(status):
+    """Apply pending schema migrations."""
+    conn = open_db()
+    try:
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        pending = [(number, description) for number, description, _ in MIGRATIONS if number > version]
+        if status or not pending:
+            click.echo(f"schema at version {version} of {SCHEMA_VERSION}")
+            for number, description in pending:
+                click.echo(f"  pending {number}: {description}")
+            return
+        applied = apply_migrations(conn)
+        click.echo(f"applied {len(applied)} migration(s); schema at version {SCHEMA_VERSION}")
+    finally:
+        conn.close()
+
 def seed_users(conn):
     cur = conn.cursor()
     existing = cur.execute("SELECT COUNT(*) as c FROM users").fetchone()[0]
@@ -259,7 +781,6 @@ def seed_users(conn):
                 generate_password_hash(u["password"]),
             ),
         )
-    conn.commit()
 
 
 def seed_services(conn):
@@ -397,7 +918,6 @@ def seed_services(conn):
             """,
             (name, desc, price, deposit, image_url, category, duration, processing, block, color),
         )
-    conn.commit()
 
 
 def seed_availability(conn):
@@ -412,7 +932,6 @@ def seed_availability(conn):
                 "INSERT INTO availability (employee_id, weekday, start_time, end_time) VALUES (?, ?, ?, ?)",
                 (emp["id"], weekday, "08:00", "20:00"),
             )
-    conn.commit()
 
 
 def seed_settings(conn):
@@ -420,11 +939,18 @@ def seed_settings(conn):
     cur.execute(
         "INSERT OR IGNORE INTO site_settings (key, value) VALUES ('announcement', 'Now booking 8am-8pm with Kim Quraishi. Text (313) 598-0229 for concierge-free support.')"
     )
-    conn.commit()
 
 
 # ---------- Utilities ----------
 
+DB_TIME_FORMAT = "%Y-%m-%dT%H:%M:%S"
+
+
+def to_db_time(value: datetime) -> str:
+    """Render ``value`` the way appointment/time-off columns are stored."""
+    return value.strftime(DB_TIME_FORMAT)
+
+
 def format_currency(cents: int) -> str:
     return f"${cents / 100:,.2f}"
 
@@ -433,6 +959,7 @@ def save_uploaded_image(file_storage):
     if not file_storage or not file_storage.filename:
         return None
     filename = secure_filename(file_storage.filename)
+    os.makedirs(app.config["UPLOAD_FOLDER"], exist_ok=True)
     dest_path = os.path.join(app.config["UPLOAD_FOLDER"], filename)
     file_storage.save(dest_path)
     return f"/static/uploads/{filename}"
@@ -458,65 +985,924 @@ def current_user():
     user_id = session.get("user_id")
     if not user_id:
         return None
+    cached = g.get("current_user")
+    if cached and cached[0] == user_id:
+        return cached[1]
     conn = get_db()
     user = conn.execute("SELECT * FROM users WHERE id=?", (user_id,)).fetchone()
-    conn.close()
+    g.current_user = (user_id, user)
     return user
 
 
+# ---------- Metrics ----------
+
+# Each worker keeps deltas in memory and adds them to metric_samples at most
+# this often, so /metrics sums every process without a write per request.
+METRICS_FLUSH_SECONDS = 10
+METRICS_GAUGE_TTL_SECONDS = 300
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+METRIC_FAMILIES = {
+    "kimq_http_request_duration_seconds": ("histogram", "Request latency by endpoint, method and status."),
+    "kimq_http_request_db_seconds_total": ("counter", "Time spent in SQLite while serving requests."),
+    "kimq_http_request_db_queries_total": ("counter", "SQL statements issued while serving requests."),
+    "kimq_outbound_duration_seconds": ("histogram", "Latency of each attempt to call Stripe, Resend, EZTexting and Instagram."),
+    "kimq_http_requests_in_flight": ("gauge", "Requests being served right now, summed across workers."),
+}
+_metrics_lock = threading.Lock()
+_metrics_pending = Counter()
+_metrics_in_flight = 0
+_metrics_flushed_at = 0.0
+
+
+def render_labels(labels):
+    return ",".join(
+        '{}="{}"'.format(key, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for key, value in labels.items()
+    )
+
+
+def increment_metric(name, amount=1, **labels):
+    with _metrics_lock:
+        _metrics_pending[(name, render_labels(labels))] += amount
+
+
+def observe_latency(family, seconds, **labels):
+    """Record one observation in the cumulative buckets of histogram ``family``."""
+    base = render_labels(labels)
+    prefix = base + "," if base else ""
+    with _metrics_lock:
+        for bound in LATENCY_BUCKETS:
+            _metrics_pending[(family + "_bucket", f'{prefix}le="{bound}"')] += 1 if seconds <= bound else 0
+        _metrics_pending[(family + "_bucket", f'{prefix}le="+Inf"')] += 1
+        _metrics_pending[(family + "_sum", base)] += seconds
+        _metrics_pending[(family + "_count", base)] += 1
+
+
+def record_outbound(provider, seconds, outcome):
+    observe_latency("kimq_outbound_duration_seconds", seconds, provider=provider, outcome=outcome)
+
+
+integrations.set_observer(record_outbound)
+
+
+def flush_metrics(force=False):
+    """Add this worker's pending deltas and in-flight gauge to the shared tables."""
+    global _metrics_flushed_at
+    now = time.monotonic()
+    with _metrics_lock:
+        if not force and now - _metrics_flushed_at < METRICS_FLUSH_SECONDS:
+            return
+        _metrics_flushed_at = now
+        pending = dict(_metrics_pending)
+        _metrics_pending.clear()
+        in_flight = _metrics_in_flight
+    updated_at = datetime.utcnow()
+    conn = connect_db()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.executemany(
+            """
+            INSERT INTO metric_samples (name, labels, value) VALUES (?, ?, ?)
+            ON CONFLICT(name, labels) DO UPDATE SET value = value + excluded.value
+            """,
+            [(name, labels, value) for (name, labels), value in pending.items()],
+        )
+        conn.execute(
+            """
+            INSERT INTO metric_gauges (pid, name, labels, value, updated_at) VALUES (?, 'kimq_http_requests_in_flight', '', ?, ?)
+            ON CONFLICT(pid, name, labels) DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at
+            """,
+            (os.getpid(), in_flight, to_db_time(updated_at)),
+        )
+        conn.execute(
+            "DELETE FROM metric_gauges WHERE updated_at < ?",
+            (to_db_time(updated_at - timedelta(seconds=METRICS_GAUGE_TTL_SECONDS)),),
+        )
+        conn.commit()
+    except sqlite3.Error:
+        conn.rollback()
+        with _metrics_lock:
+            _metrics_pending.update(pending)
+    finally:
+        conn.close()
+
+
+@atexit.register
+def flush_metrics_at_exit():
+    # Only workers that served requests leave a gauge row behind; zero it on shutdown.
+    if _metrics_flushed_at or _metrics_pending:
+        flush_metrics(force=True)
+
+
+def sample_sort_key(sample):
+    name, labels, _ = sample
+    match = re.search(r'(?:^|,)le="([^"]+)"$', labels)
+    base = labels[: match.start()] if match else labels
+    suffix_order = 2 if name.endswith("_count") else 1 if name.endswith("_sum") else 0
+    return (base, suffix_order, float(match.group(1)) if match else 0.0)
+
+
+def render_metrics(conn):
+    """Prometheus text exposition of the samples every worker has flushed."""
+    samples = [(row["name"], row["labels"], row["value"]) for row in conn.execute("SELECT name, labels, value FROM metric_samples")]
+    cutoff = to_db_time(datetime.utcnow() - timedelta(seconds=METRICS_GAUGE_TTL_SECONDS))
+    samples += [
+        (row["name"], row["labels"], row["value"])
+        for row in conn.execute(
+            "SELECT name, labels, SUM(value) AS value FROM metric_gauges WHERE updated_at >= ? GROUP BY name, labels",
+            (cutoff,),
+        )
+    ]
+    lines = []
+    for family, (kind, help_text) in METRIC_FAMILIES.items():
+        names = {family} if kind != "histogram" else {family + "_bucket", family + "_sum", family + "_count"}
+        series = sorted((sample for sample in samples if sample[0] in names), key=sample_sort_key)
+        lines.append(f"# HELP {family} {help_text}")
+        lines.append(f"# TYPE {family} {kind}")
+        for name, labels, value in series:
+            value = float(value)
+            rendered = str(int(value)) if value.is_integer() else repr(value)
+            lines.append(f"{name}{{{labels}}} {rendered}" if labels else f"{name} {rendered}")
+    return "\n".join(lines) + "\n"
+
+
+@app.before_request
+def start_request_metrics():
+    global _metrics_in_flight
+    g.metrics_started = time.perf_counter()
+    with _metrics_lock:
+        _metrics_in_flight += 1
+
+
+@app.after_request
+def remember_response_status(response):
+    g.metrics_status = response.status_code
+    return response
+
+
+@app.teardown_request
+def finish_request_metrics(exc):
+    global _metrics_in_flight
+    started = g.pop("metrics_started", None)
+    if started is None:
+        return
+    endpoint = request.endpoint or "unmatched"
+    observe_latency(
+        "kimq_http_request_duration_seconds",
+        time.perf_counter() - started,
+        endpoint=endpoint,
+        method=request.method,
+        status=g.get("metrics_status", 500),
+    )
+    conn = g.get("db")
+    if isinstance(conn, InstrumentedConnection):
+        increment_metric("kimq_http_request_db_seconds_total", conn.query_seconds, endpoint=endpoint)
+        increment_metric("kimq_http_request_db_queries_total", conn.query_count, endpoint=endpoint)
+    with _metrics_lock:
+        _metrics_in_flight -= 1
+    flush_metrics()
+
+
+# ---------- Profiling ----------
+
+PROFILE_NAME_PATTERN = re.compile(r"^(\d{8}T\d{12})-([\w.-]+)-(\d+)ms-(\d+)\.prof$")
+
+
+def profiling_requested():
+    """Profile a sampled share of traffic, or any request an admin asks for."""
+    sample_rate = app.config["PROFILE_SAMPLE_RATE"]
+    if sample_rate and random.random() < sample_rate:
+        return True
+    if request.args.get("_profile") or request.headers.get("X-Profile"):
+        return bool(require_role("admin"))
+    return False
+
+
+@app.before_request
+def start_profiler():
+    if request.endpoint == "static" or not profiling_requested():
+        return
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # Another profiler already owns this thread.
+        return
+    g.profiler = (profiler, time.perf_counter())
+
+
+@app.teardown_request
+def save_profile(exc):
+    entry = g.pop("profiler", None)
+    if entry is None:
+        return
+    profiler, started = entry
+    profiler.disable()
+    elapsed_ms = int((time.perf_counter() - started) * 1000)
+    name = f"{datetime.utcnow():%Y%m%dT%H%M%S%f}-{request.endpoint or 'unmatched'}-{elapsed_ms}ms-{os.getpid()}.prof"
+    profile_dir = app.config["PROFILE_DIR"]
+    os.makedirs(profile_dir, exist_ok=True)
+    profiler.dump_stats(os.path.join(profile_dir, name))
+    for stale in list_profiles()[app.config["PROFILE_MAX_FILES"]:]:
+        try:
+            os.remove(os.path.join(profile_dir, stale["name"]))
+        except FileNotFoundError:
+            pass
+
+
+def list_profiles():
+    """Captured profiles, newest first, described from their file names."""
+    profile_dir = app.config["PROFILE_DIR"]
+    if not os.path.isdir(profile_dir):
+        return []
+    profiles = []
+    for name in sorted(os.listdir(profile_dir), reverse=True):
+        match = PROFILE_NAME_PATTERN.match(name)
+        if not match:
+            continue
+        profiles.append(
+            {
+                "name": name,
+                "captured_at": datetime.strptime(match.group(1), "%Y%m%dT%H%M%S%f"),
+                "endpoint": match.group(2),
+                "elapsed_ms": int(match.group(3)),
+                "pid": int(match.group(4)),
+            }
+        )
+    return profiles
+
+
+def profile_report(name, limit=40):
+    stream = io.StringIO()
+    stats = pstats.Stats(os.path.join(app.config["PROFILE_DIR"], name), stream=stream)
+    stats.strip_dirs().sort_stats("cumulative").print_stats(limit)
+    return stream.getvalue()
+
+
 # ---------- Integration helpers ----------
 
-def create_payment_intent(amount_cents: int, description: str, customer_email: str | None = None):
+def create_payment_intent(
+    amount_cents: int, description: str, customer_email: str | None = None, idempotency_key: str | None = None
+):
+    """Create a PaymentIntent; calls repeating ``idempotency_key`` get the original intent back."""
     test_key = os.environ.get("STRIPE_TEST_KEY")
-    stripe.api_key = test_key or os.environ.get("STRIPE_SECRET_KEY")
-    if not stripe.api_key:
-        fake_id = "pi_" + secrets.token_hex(8)
-        return fake_id, "simulated"
-    intent = stripe.PaymentIntent.create(
-        amount=amount_cents,
-        currency="usd",
-        description=description,
-        receipt_email=customer_email,
-        automatic_payment_methods={"enabled": True},
-        metadata={"mode": "test" if test_key else "live"},
+    api_key = test_key or os.environ.get("STRIPE_SECRET_KEY")
+    if not api_key:
+        if idempotency_key:
+            return "pi_sim_" + hashlib.sha256(idempotency_key.encode()).hexdigest()[:16], "simulated"
+        return "pi_" + secrets.token_hex(8), "simulated"
+    client = integrations.stripe_client(api_key)
+    intent = integrations.provider("stripe").call(
+        client.payment_intents.create,
+        params={
+            "amount": amount_cents,
+            "currency": "usd",
+            "description": description,
+            "receipt_email": customer_email,
+            "automatic_payment_methods": {"enabled": True},
+            "metadata": {"mode": "test" if test_key else "live"},
+        },
+        options={"idempotency_key": idempotency_key} if idempotency_key else {},
     )
     return intent.id, intent.status
 
 
-def send_email(to_email: str, subject: str, body: str):
+def send_email(to_email: str, subject: str, body: str, idempotency_key: str | None = None):
+    """Deliver one message now. Request handlers should use queue_email instead."""
     api_key = os.environ.get("RESEND_API_KEY")
     if not api_key:
         print(f"[email skipped] {subject} -> {to_email}\n{body}")
         return
-    requests.post(
-        "https://api.resend.com/emails",
-        headers={"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"},
+    headers = {"Authorization": f"Bearer {api_key}"}
+    if idempotency_key:
+        headers["Idempotency-Key"] = idempotency_key
+    integrations.provider("resend").request(
+        "POST",
+        "/emails",
+        idempotent=bool(idempotency_key),
+        headers=headers,
         json={
             "from": "Kim Quraishi Beauty Studio <hello@kimq.com>",
             "to": [to_email],
             "subject": subject,
             "html": body,
         },
-        timeout=10,
     )
 
 
+def send_email_batch(messages, idempotency_key: str | None = None):
+    """Deliver up to 100 ``{"to", "subject", "html"}`` messages in one Resend call."""
+    api_key = os.environ.get("RESEND_API_KEY")
+    if not api_key:
+        for message in messages:
+            print(f"[email skipped] {message['subject']} -> {message['to']}\n{message['html']}")
+        return
+    headers = {"Authorization": f"Bearer {api_key}"}
+    if idempotency_key:
+        headers["Idempotency-Key"] = idempotency_key
+    integrations.provider("resend").request(
+        "POST",
+        "/emails/batch",
+        idempotent=bool(idempotency_key),
+        headers=headers,
+        json=[
+            {
+                "from": "Kim Quraishi Beauty Studio <hello@kimq.com>",
+                "to": [message["to"]],
+                "subject": message["subject"],
+                "html": message["html"],
+            }
+            for message in messages
+        ],
+    )
+
+
+def send_sms(to_phone: str, body: str):
+    """Text one message now through EZTexting. Request handlers should use queue_sms instead."""
+    api_key = os.environ.get("EZTEXTING_API_KEY")
+    digits = re.sub(r"\D", "", to_phone or "")
+    if not api_key or not digits:
+        print(f"[sms skipped] -> {to_phone}\n{body}")
+        return
+    integrations.provider("eztexting").request(
+        "POST",
+        "/messages",
+        headers={"Authorization": f"Bearer {api_key}"},
+        json={"message": body, "toNumbers": [digits[-10:]]},
+    )
+
+# ---------- Email outbox ----------
+
+OUTBOX_BATCH_SIZE = 20
+OUTBOX_MAX_ATTEMPTS = 6
+OUTBOX_RETRY_BASE_SECONDS = 30
+# A claimed message is retried if its worker has not reported back by then.
+OUTBOX_LEASE_SECONDS = 120
+OUTBOX_POLL_SECONDS = 15
+_outbox_wakeup = threading.Event()
+_outbox_thread = None
+_outbox_thread_lock = threading.Lock()
+
+
+def queue_email(conn, to_email: str, subject: str, body: str):
+    """Add a message to the outbox; it goes out once the caller commits."""
+    conn.execute(
+        "INSERT INTO email_outbox (to_email, subject, body) VALUES (?, ?, ?)",
+        (to_email, subject, body),
+    )
+
+
+def queue_sms(conn, to_phone: str, body: str):
+    """Add a text message to the outbox; it goes out once the caller commits."""
+    conn.execute(
+        "INSERT INTO email_outbox (channel, to_email, subject, body) VALUES ('sms', ?, '', ?)",
+        (to_phone, body),
+    )
+
+
+def claim_outbox_batch(conn, limit: int = OUTBOX_BATCH_SIZE):
+    now = datetime.utcnow()
+    conn.execute("BEGIN IMMEDIATE")
+    rows = conn.execute(
+        "SELECT * FROM email_outbox WHERE status='pending' AND next_attempt_at <= ? ORDER BY next_attempt_at LIMIT ?",
+        (to_db_time(now), limit),
+    ).fetchall()
+    lease_until = to_db_time(now + timedelta(seconds=OUTBOX_LEASE_SECONDS))
+    conn.executemany(
+        "UPDATE email_outbox SET attempts=attempts+1, next_attempt_at=? WHERE id=?",
+        [(lease_until, row["id"]) for row in rows],
+    )
+    conn.commit()
+    return rows
+
+
+def drain_outbox(limit: int = OUTBOX_BATCH_SIZE) -> int:
+    """Send one batch of due messages and record the outcome. Returns the batch size."""
+    conn = connect_db()
+    try:
+        batch = claim_outbox_batch(conn, limit)
+        sent = []
+        retries = []
+        deferred = []
+        for row in batch:
+            try:
+                if row["channel"] == "sms":
+                    send_sms(row["to_email"], row["body"])
+                else:
+                    send_email(row["to_email"], row["subject"], row["body"], idempotency_key=f"outbox-{row['id']}")
+            except integrations.CircuitOpenError as exc:
+                # The provider is known to be down; wait it out without spending an attempt.
+                deferred.append((to_db_time(datetime.utcnow() + timedelta(seconds=exc.retry_in)), str(exc), row["id"]))
+            except Exception as exc:  # noqa: BLE001
+                attempts = row["attempts"] + 1
+                status = "failed" if attempts >= OUTBOX_MAX_ATTEMPTS else "pending"
+                delay = OUTBOX_RETRY_BASE_SECONDS * 2 ** (attempts - 1)
+                retries.append(
+                    (status, to_db_time(datetime.utcnow() + timedelta(seconds=delay)), str(exc)[:500], row["id"])
+                )
+            else:
+                sent.append((to_db_time(datetime.utcnow()), row["id"]))
+        conn.executemany("UPDATE email_outbox SET status='sent', sent_at=?, last_error=NULL WHERE id=?", sent)
+        conn.executemany("UPDATE email_outbox SET status=?, next_attempt_at=?, last_error=? WHERE id=?", retries)
+        conn.executemany(
+            "UPDATE email_outbox SET attempts=attempts-1, next_attempt_at=?, last_error=? WHERE id=?", deferred
+        )
+        conn.commit()
+        return len(batch)
+    finally:
+        conn.close()
+
+
+def outbox_worker(poll_seconds: float = OUTBOX_POLL_SECONDS):
+    while True:
+        _outbox_wakeup.wait(poll_seconds)
+        _outbox_wakeup.clear()
+        try:
+            while drain_outbox() == OUTBOX_BATCH_SIZE:
+                pass
+        except Exception as exc:  # noqa: BLE001
+            print(f"[outbox] drain failed: {exc}")
+
+
+def notify_outbox():
+    """Wake the in-process sender after queued mail has been committed.
+
+    Set EMAIL_OUTBOX_WORKER=external when ``flask drain-outbox --loop`` runs
+    as its own process; the web workers then only enqueue.
+    """
+    global _outbox_thread
+    if os.environ.get("EMAIL_OUTBOX_WORKER", "thread") != "thread":
+        return
+    with _outbox_thread_lock:
+        if _outbox_thread is None or not _outbox_thread.is_alive():
+            _outbox_thread = threading.Thread(target=outbox_worker, name="email-outbox", daemon=True)
+            _outbox_thread.start()
+    _outbox_wakeup.set()
+
+
+@app.cli.command("drain-outbox")
+@click.option("--loop", is_flag=True, help="Keep polling instead of exiting once the outbox is empty.")
+@click.option("--batch-size", default=OUTBOX_BATCH_SIZE, show_default=True)
+def drain_outbox_command(loop, batch_size):
+    """Send queued transactional email."""
+    while True:
+        count = drain_outbox(batch_size)
+        if count:
+            click.echo(f"processed {count} message(s)")
+        elif not loop:
+            break
+        else:
+            time.sleep(OUTBOX_POLL_SECONDS)
+
+
+# ---------- Appointment reminders ----------
+
+# (kind, lead time): the 24h reminder covers appointments 2-24 hours out, the 2h
+# reminder the last two hours, so a late booking only gets the closer one.
+REMINDER_KINDS = (("2h", timedelta(hours=2)), ("24h", timedelta(hours=24)))
+REMINDER_MAX_ATTEMPTS = 3
+# A claimed reminder whose run died before recording a result is retried after this.
+REMINDER_LEASE_SECONDS = 15 * 60
+REMINDER_POLL_SECONDS = 5 * 60
+REMINDER_WORKERS = int(os.environ.get("REMINDER_WORKERS", "4"))
+# Resend accepts up to 100 messages per /emails/batch call.
+REMINDER_EMAIL_BATCH = 100
+_reminder_thread = None
+_reminder_thread_lock = threading.Lock()
+
+
+def due_reminders(conn, now: datetime | None = None):
+    """Every (appointment, kind, channel) reminder due now and not yet delivered, from one range query.
+
+    The window is a single range over idx_appointments_start; delivery state
+    comes from appointment_reminders by primary key in the same statement.
+    """
+    now = now or datetime.now()
+    (near_kind, near_lead), (far_kind, far_lead) = REMINDER_KINDS
+    lease_cutoff = to_db_time(datetime.utcnow() - timedelta(seconds=REMINDER_LEASE_SECONDS))
+    kind = "CASE WHEN a.start_time <= :near_end THEN :near_kind ELSE :far_kind END"
+    rows = conn.execute(
+        f"""
+        SELECT a.id, a.start_time, c.name AS client_name, c.email, c.phone,
+               s.name AS service_name, u.name AS employee_name, {kind} AS kind,
+               re.status AS email_status, re.attempts AS email_attempts, re.claimed_at AS email_claimed_at,
+               rs.status AS sms_status, rs.attempts AS sms_attempts, rs.claimed_at AS sms_claimed_at
+        FROM appointments a
+        JOIN clients c ON c.id = a.client_id
+        LEFT JOIN services s ON s.id = a.service_id
+        LEFT JOIN users u ON u.id = a.employee_id
+        LEFT JOIN appointment_reminders re ON re.appointment_id = a.id AND re.kind = {kind} AND re.channel = 'email'
+        LEFT JOIN appointment_reminders rs ON rs.appointment_id = a.id AND rs.kind = {kind} AND rs.channel = 'sms'
+        WHERE a.start_time > :now AND a.start_time <= :far_end AND a.status = 'Booked'
+        ORDER BY a.start_time
+        """,
+        {
+            "now": to_db_time(now),
+            "near_end": to_db_time(now + near_lead),
+            "far_end": to_db_time(now + far_lead),
+            "near_kind": near_kind,
+            "far_kind": far_kind,
+        },
+    ).fetchall()
+
+    def pending(status, attempts, claimed_at):
+        if status is None:
+            return True
+        if status == "failed":
+            return attempts < REMINDER_MAX_ATTEMPTS
+        return status == "sending" and (claimed_at or "") < lease_cutoff
+
+    due = []
+    for row in rows:
+        if row["email"] and pending(row["email_status"], row["email_attempts"], row["email_claimed_at"]):
+            due.append((row, "email"))
+        if row["phone"] and pending(row["sms_status"], row["sms_attempts"], row["sms_claimed_at"]):
+            due.append((row, "sms"))
+    return due
+
+
+def claim_reminders(conn, due):
+    """Mark ``due`` as sending under a fresh run token; returns the (row, channel) pairs this run won."""
+    token = secrets.token_hex(8)
+    now = datetime.utcnow()
+    lease_cutoff = to_db_time(now - timedelta(seconds=REMINDER_LEASE_SECONDS))
+    conn.execute("BEGIN IMMEDIATE")
+    conn.executemany(
+        """
+        INSERT INTO appointment_reminders (appointment_id, kind, channel, status, attempts, run_token, claimed_at)
+        VALUES (?, ?, ?, 'sending', 1, ?, ?)
+        ON CONFLICT (appointment_id, kind, channel) DO UPDATE
+        SET status='sending', attempts=attempts+1, run_token=excluded.run_token, claimed_at=excluded.claimed_at
+        WHERE (status='failed' AND attempts < ?) OR (status='sending' AND claimed_at < ?)
+        """,
+        [
+            (row["id"], row["kind"], channel, token, to_db_time(now), REMINDER_MAX_ATTEMPTS, lease_cutoff)
+            for row, channel in due
+        ],
+    )
+    # Look the rows up by the keys just upserted: run_token has no index.
+    won = {
+        (appointment_id, channel)
+        for appointment_id, channel in conn.execute(
+            """
+            SELECT r.appointment_id, r.channel
+            FROM json_each(?) j
+            JOIN appointment_reminders r ON r.appointment_id = json_extract(j.value, '$[0]')
+                AND r.kind = json_extract(j.value, '$[1]') AND r.channel = json_extract(j.value, '$[2]')
+            WHERE r.run_token=? AND r.status='sending'
+            """,
+            (json.dumps([(row["id"], row["kind"], channel) for row, channel in due]), token),
+        )
+    }
+    conn.commit()
+    return [(row, channel) for row, channel in due if (row["id"], channel) in won]
+
+
+def render_reminder(row, channel, today: date):
+    """The message for one reminder; ``today`` is the local date it is sent on."""
+    start_at = datetime.fromisoformat(row["start_time"])
+    service = row["service_name"] or "beauty"
+    artist = f" with {row['employee_name']}" if row["employee_name"] else ""
+    if channel == "sms":
+        return {
+            "to": row["phone"],
+            "body": f"Kim Quraishi Beauty Studio reminder: {service}{artist} on {start_at.strftime('%b %d at %I:%M %p')}.",
+        }
+    # A 24h reminder can fall on the same day, so the wording follows the date, not the kind.
+    days_away = (start_at.date() - today).days
+    when = {0: "today", 1: "tomorrow"}.get(days_away, f"on {start_at.strftime('%B %d')}")
+    return {
+        "to": row["email"],
+        "subject": f"Reminder: your appointment {when} at {start_at.strftime('%I:%M %p')}",
+        "html": f"<p>Hi {row['client_name']},</p><p>This is a reminder of your {service} appointment{artist} "
+        f"on {start_at.strftime('%B %d, %Y %I:%M %p')}.</p><p>We look forward to seeing you.</p>",
+    }
+
+
+def send_reminders(now: datetime | None = None, workers: int = REMINDER_WORKERS, dry_run: bool = False):
+    """Deliver every due reminder and record the outcome; returns counts by result.
+
+    Email goes out in Resend batches, texts one call each, all through a
+    bounded thread pool. The per-provider rate limits in ``integrations``
+    pace the calls, so the pool size only bounds concurrency.
+    """
+    conn = connect_db()
+    try:
+        now = now or datetime.now()
+        due = due_reminders(conn, now)
+        if dry_run:
+            return {"due": len(due)}
+        claimed = claim_reminders(conn, due)
+        emails = [(row, render_reminder(row, "email", now.date())) for row, channel in claimed if channel == "email"]
+        texts = [(row, render_reminder(row, "sms", now.date())) for row, channel in claimed if channel == "sms"]
+        jobs = {}
+        with ThreadPoolExecutor(max_workers=max(workers, 1), thread_name_prefix="reminders") as pool:
+            for start in range(0, len(emails), REMINDER_EMAIL_BATCH):
+                chunk = emails[start:start + REMINDER_EMAIL_BATCH]
+                # Same chunk, same key, so a retried batch is never delivered twice.
+                key = "reminders-" + hashlib.sha256(
+                    ",".join(f"{row['id']}:{row['kind']}" for row, _ in chunk).encode()
+                ).hexdigest()[:32]
+                future = pool.submit(send_email_batch, [message for _, message in chunk], key)
+                jobs[future] = [(row, "email") for row, _ in chunk]
+            for row, message in texts:
+                jobs[pool.submit(send_sms, message["to"], message["body"])] = [(row, "sms")]
+            sent, failed = [], []
+            for future in as_completed(jobs):
+                error = future.exception()
+                finished = to_db_time(datetime.utcnow())
+                for row, channel in jobs[future]:
+                    if error is None:
+                        sent.append((finished, row["id"], row["kind"], channel))
+                    else:
+                        failed.append((str(error)[:500], row["id"], row["kind"], channel))
+        conn.executemany(
+            "UPDATE appointment_reminders SET status='sent', sent_at=?, last_error=NULL "
+            "WHERE appointment_id=? AND kind=? AND channel=?",
+            sent,
+        )
+        conn.executemany(
+            "UPDATE appointment_reminders SET status='failed', last_error=? WHERE appointment_id=? AND kind=? AND channel=?",
+            failed,
+        )
+        conn.commit()
+        return {"due": len(due), "claimed": len(claimed), "sent": len(sent), "failed": len(failed)}
+    finally:
+        conn.close()
+
+
+def reminder_worker(poll_seconds: float = REMINDER_POLL_SECONDS):
+    while True:
+        try:
+            send_reminders()
+        except Exception as exc:  # noqa: BLE001
+            print(f"[reminders] run failed: {exc}")
+        time.sleep(poll_seconds)
+
+
+def start_reminder_thread():
+    """Run the reminder job in this process when REMINDER_WORKER=thread.
+
+    Left off by default; schedule ``flask send-reminders`` (or ``--loop``)
+    instead. Several processes running it at once is safe: each reminder is
+    claimed by exactly one run.
+    """
+    global _reminder_thread
+    if os.environ.get("REMINDER_WORKER", "external") != "thread":
+        return
+    with _reminder_thread_lock:
+        if _reminder_thread is None or not _reminder_thread.is_alive():
+            _reminder_thread = threading.Thread(target=reminder_worker, name="reminders", daemon=True)
+            _reminder_thread.start()
+
+
+@app.cli.command("send-reminders")
+@click.option("--loop", is_flag=True, help=f"Run every {REMINDER_POLL_SECONDS // 60} minutes instead of once.")
+@click.option("--workers", default=REMINDER_WORKERS, show_default=True, help="Concurrent provider calls.")
+@click.option("--dry-run", is_flag=True, help="Only count the reminders that are due.")
+def send_reminders_command(loop, workers, dry_run):
+    """Send 24h and 2h appointment reminders by email and SMS."""
+    while True:
+        counts = send_reminders(workers=workers, dry_run=dry_run)
+        click.echo(", ".join(f"{value} {name}" for name, value in counts.items()))
+        if not loop:
+            break
+        time.sleep(REMINDER_POLL_SECONDS)
+
+
+# ---------- Payments and Stripe webhooks ----------
+
+STRIPE_WEBHOOK_TOLERANCE_SECONDS = 5 * 60
+STRIPE_EVENTS_BATCH_SIZE = 500
+STRIPE_EVENTS_POLL_SECONDS = 30
+# An event can beat the booking that created its intent to the database; it is
+# retried this many times, STRIPE_EVENTS_POLL_SECONDS apart, before it is
+# marked unmatched.
+STRIPE_EVENT_MAX_ATTEMPTS = 10
+# Gift cards follow these events; any other event only updates the payment.
+GIFT_CARD_EVENT_STATUS = {
+    "payment_intent.succeeded": "Active",
+    "payment_intent.payment_failed": "Payment Failed",
+    "payment_intent.canceled": "Cancelled",
+    "charge.refunded": "Refunded",
+}
+_stripe_events_wakeup = threading.Event()
+_stripe_events_thread = None
+_stripe_events_thread_lock = threading.Lock()
+
+
+def reserve_payment(conn, submission_token: str, amount_cents: int, email: str, category: str):
+    """Insert the local payments row before charging, or return the one a resubmitted form already made.
+
+    The row's id and token key the Stripe call (see payment_idempotency_key),
+    so a retried submission gets the same PaymentIntent back.
+    """
+    conn.execute(
+        """
+        INSERT INTO payments (submission_token, amount_cents, status, client_email, category)
+        VALUES (?, ?, 'creating', ?, ?)
+        ON CONFLICT (submission_token) DO NOTHING
+        """,
+        (submission_token, amount_cents, email, category),
+    )
+    payment = conn.execute("SELECT * FROM payments WHERE submission_token=?", (submission_token,)).fetchone()
+    conn.commit()
+    if payment["amount_cents"] != amount_cents or payment["category"] != category:
+        # The form was changed before it was sent again: a different purchase,
+        # keyed on the edit so sending the edited form twice still charges once.
+        return reserve_payment(conn, f"{submission_token}:{category}:{amount_cents}", amount_cents, email, category)
+    return payment
+
+
+def abandon_payment(conn, payment_id: int, payment_intent_id: str | None = None):
+    """Mark a reserved payments row as never charged, unless another submission of the form completed it."""
+    conn.execute(
+        "UPDATE payments SET status='abandoned', payment_intent_id=COALESCE(?, payment_intent_id) "
+        "WHERE id=? AND status IN ('creating', 'abandoned')",
+        (payment_intent_id, payment_id),
+    )
+    conn.commit()
+
+
+# Payments rows that never became a charge: reserved before the Stripe call
+# ('creating') or given up when it or the booking failed ('abandoned').
+CHARGED_PAYMENT = "status NOT IN ('creating', 'abandoned')"
+
+
+def payment_idempotency_key(payment, description: str) -> str:
+    # Stripe rejects a reused key with different parameters, so an edited
+    # resubmission gets its own key.
+    digest = hashlib.sha256(f"{payment['amount_cents']}:{description}".encode()).hexdigest()[:12]
+    return f"kimq-payment-{payment['id']}-{payment['submission_token']}-{digest}"
+
+
+def stripe_signature(payload: bytes, secret: str, timestamp: int | None = None) -> str:
+    """The Stripe-Signature header Stripe sends with ``payload``; also signs simulated events."""
+    timestamp = int(time.time()) if timestamp is None else timestamp
+    digest = hmac.new(secret.encode(), f"{timestamp}.".encode() + payload, hashlib.sha256).hexdigest()
+    return f"t={timestamp},v1={digest}"
+
+
+def verify_stripe_signature(payload: bytes, header: str | None, secret: str,
+                            tolerance: int = STRIPE_WEBHOOK_TOLERANCE_SECONDS) -> bool:
+    fields = [item.split("=", 1) for item in (header or "").split(",") if "=" in item]
+    timestamps = [value for key, value in fields if key == "t" and value.isdigit()]
+    signatures = [value for key, value in fields if key == "v1"]
+    if not timestamps or not signatures or abs(time.time() - int(timestamps[0])) > tolerance:
+        return False
+    expected = stripe_signature(payload, secret, int(timestamps[0])).split("v1=", 1)[1]
+    return any(hmac.compare_digest(expected, signature) for signature in signatures)
+
+
+def process_stripe_events(limit: int = STRIPE_EVENTS_BATCH_SIZE) -> int:
+    """Apply one batch of queued webhook events in a single transaction. Returns the batch size.
+
+    Only the newest event per PaymentIntent in the batch is written, and
+    ``payments.stripe_event_at`` keeps an older event from a later batch
+    overwriting a newer status. Events for intents with no local payment yet
+    are retried later.
+    """
+    conn = connect_db()
+    try:
+        now = datetime.utcnow()
+        conn.execute("BEGIN IMMEDIATE")
+        events = conn.execute(
+            "SELECT id, type, payload, attempts FROM stripe_events WHERE status='pending' AND next_attempt_at <= ? "
+            "ORDER BY next_attempt_at, id LIMIT ?",
+            (to_db_time(now), limit),
+        ).fetchall()
+        latest = {}
+        handled, ignored, failed = [], [], []
+        for event in events:
+            try:
+                data = json.loads(event["payload"])
+                obj = data["data"]["object"]
+                created = int(data["created"])
+                if event["type"].startswith("payment_intent."):
+                    intent_id, status = obj["id"], obj["status"]
+                elif event["type"] == "charge.refunded":
+                    intent_id, status = obj["payment_intent"], "refunded"
+                else:
+                    ignored.append(event["id"])
+                    continue
+            except (ValueError, KeyError, TypeError) as exc:
+                failed.append((f"malformed event: {exc!r}"[:500], event["id"]))
+                continue
+            handled.append((event, intent_id))
+            if intent_id not in latest or created >= latest[intent_id][0]:
+                latest[intent_id] = (created, status, GIFT_CARD_EVENT_STATUS.get(event["type"]))
+        known = {
+            row[0]
+            for row in conn.execute(
+                "SELECT DISTINCT payment_intent_id FROM payments WHERE payment_intent_id IN (SELECT value FROM json_each(?))",
+                (json.dumps(list(latest)),),
+            )
+        }
+        latest = {intent_id: update for intent_id, update in latest.items() if intent_id in known}
+        deferred = [(event, intent_id) for event, intent_id in handled if intent_id not in known]
+        handled = [event["id"] for event, intent_id in handled if intent_id in known]
+        conn.executemany(
+            "UPDATE payments SET status=?, stripe_event_at=? WHERE payment_intent_id=? AND COALESCE(stripe_event_at, 0) <= ?",
+            [(status, created, intent_id, created) for intent_id, (created, status, _) in latest.items()],
+        )
+        still_newest = "? >= COALESCE((SELECT MAX(stripe_event_at) FROM payments WHERE payment_intent_id=?), 0)"
+        conn.executemany(
+            f"UPDATE appointments SET payment_status=? WHERE payment_intent_id=? AND {still_newest}",
+            [(status, intent_id, created, intent_id) for intent_id, (created, status, _) in latest.items()],
+        )
+        conn.executemany(
+            f"UPDATE gift_cards SET status=? WHERE payment_intent_id=? AND {still_newest}",
+            [
+                (gift_status, intent_id, created, intent_id)
+                for intent_id, (created, _, gift_status) in latest.items()
+                if gift_status
+            ],
+        )
+        processed_at = to_db_time(datetime.utcnow())
+        conn.executemany(
+            "UPDATE stripe_events SET status='processed', processed_at=? WHERE id=?",
+            [(processed_at, event_id) for event_id in handled],
+        )
+        conn.executemany(
+            "UPDATE stripe_events SET status='ignored', processed_at=? WHERE id=?",
+            [(processed_at, event_id) for event_id in ignored],
+        )
+        conn.executemany("UPDATE stripe_events SET status='failed', last_error=? WHERE id=?", failed)
+        retry_at = to_db_time(now + timedelta(seconds=STRIPE_EVENTS_POLL_SECONDS))
+        conn.executemany(
+            "UPDATE stripe_events SET status=?, attempts=attempts+1, next_attempt_at=?, last_error=? WHERE id=?",
+            [
+                (
+                    "pending" if event["attempts"] + 1 < STRIPE_EVENT_MAX_ATTEMPTS else "unmatched",
+                    retry_at,
+                    f"no local payment for {intent_id}",
+                    event["id"],
+                )
+                for event, intent_id in deferred
+            ],
+        )
+        conn.commit()
+        return len(events)
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+def stripe_events_worker(poll_seconds: float = STRIPE_EVENTS_POLL_SECONDS):
+    while True:
+        _stripe_events_wakeup.wait(poll_seconds)
+        _stripe_events_wakeup.clear()
+        try:
+            while process_stripe_events() == STRIPE_EVENTS_BATCH_SIZE:
+                pass
+        except Exception as exc:  # noqa: BLE001
+            print(f"[stripe] event processing failed: {exc}")
+
+
+def notify_stripe_events():
+    """Wake the in-process event worker; STRIPE_EVENTS_WORKER=external leaves it to ``flask process-stripe-events``."""
+    global _stripe_events_thread
+    if os.environ.get("STRIPE_EVENTS_WORKER", "thread") != "thread":
+        return
+    with _stripe_events_thread_lock:
+        if _stripe_events_thread is None or not _stripe_events_thread.is_alive():
+            _stripe_events_thread = threading.Thread(target=stripe_events_worker, name="stripe-events", daemon=True)
+            _stripe_events_thread.start()
+    _stripe_events_wakeup.set()
+
+
+@app.cli.command("process-stripe-events")
+@click.option("--loop", is_flag=True, help="Keep polling instead of exiting once the queue is empty.")
+@click.option("--batch-size", default=STRIPE_EVENTS_BATCH_SIZE, show_default=True)
+def process_stripe_events_command(loop, batch_size):
+    """Apply queued Stripe webhook events to payments, appointments and gift cards."""
+    while True:
+        count = process_stripe_events(batch_size)
+        if count:
+            click.echo(f"processed {count} event(s)")
+        elif not loop:
+            break
+        else:
+            time.sleep(STRIPE_EVENTS_POLL_SECONDS)
+
+
 def fetch_instagram_posts(limit: int = 6):
     token = os.environ.get("INSTAGRAM_ACCESS_TOKEN")
     user_id = os.environ.get("INSTAGRAM_USER_ID", "me")
     if not token:
         return []
     try:
-        resp = requests.get(
-            f"https://graph.instagram.com/{user_id}/media",
+        resp = integrations.provider("instagram").request(
+            "GET",
+            f"/{user_id}/media",
             params={
                 "fields": "id,caption,media_url,thumbnail_url,permalink",
                 "access_token": token,
                 "limit": limit,
             },
-            timeout=10,
         )
-        resp.raise_for_status()
         data = resp.json().get("data", [])
         posts = []
         for item in data:
@@ -533,33 +1919,197 @@ def fetch_instagram_posts(limit: int = 6):
         return []
 
 
-def read_log_tail(path: str, max_lines: int = 200):
+INSTAGRAM_FEED_LIMIT = 9
+INSTAGRAM_CACHE_TTL_SECONDS = 15 * 60
+# How long a worker owns a refresh, and how soon to retry after an empty fetch.
+INSTAGRAM_REFRESH_LEASE_SECONDS = 2 * 60
+INSTAGRAM_RETRY_SECONDS = 5 * 60
+
+
+def cached_instagram_posts(conn):
+    """Serve the shared feed cache and kick off a background refresh when stale.
+
+    Only the worker whose conditional UPDATE claims the refresh lease fetches
+    from the Graph API, so the page itself never waits on Instagram.
+    """
+    now = to_db_time(datetime.utcnow())
+    row = conn.execute("SELECT payload, refresh_after FROM feed_cache WHERE key='instagram'").fetchone()
+    if row is None or row["refresh_after"] <= now:
+        lease_until = to_db_time(datetime.utcnow() + timedelta(seconds=INSTAGRAM_REFRESH_LEASE_SECONDS))
+        claimed = conn.execute(
+            """
+            INSERT INTO feed_cache (key, refresh_after) VALUES ('instagram', ?)
+            ON CONFLICT(key) DO UPDATE SET refresh_after=excluded.refresh_after WHERE feed_cache.refresh_after <= ?
+            """,
+            (lease_until, now),
+        ).rowcount
+        conn.commit()
+        if claimed:
+            threading.Thread(target=refresh_instagram_cache, name="instagram-refresh", daemon=True).start()
+    if row is None or not row["payload"]:
+        return []
+    return json.loads(row["payload"])
+
+
+def refresh_instagram_cache():
+    posts = fetch_instagram_posts(limit=INSTAGRAM_FEED_LIMIT)
+    conn = connect_db()
+    try:
+        now = datetime.utcnow()
+        if posts:
+            conn.execute(
+                """
+                INSERT INTO feed_cache (key, payload, fetched_at, refresh_after) VALUES ('instagram', ?, ?, ?)
+                ON CONFLICT(key) DO UPDATE SET payload=excluded.payload, fetched_at=excluded.fetched_at, refresh_after=excluded.refresh_after
+                """,
+                (json.dumps(posts), to_db_time(now), to_db_time(now + timedelta(seconds=INSTAGRAM_CACHE_TTL_SECONDS))),
+            )
+        else:
+            # Keep serving whatever we had; try again later.
+            conn.execute(
+                "UPDATE feed_cache SET refresh_after=? WHERE key='instagram'",
+                (to_db_time(now + timedelta(seconds=INSTAGRAM_RETRY_SECONDS)),),
+            )
+        conn.commit()
+    finally:
+        conn.close()
+    return posts
+
+
+@app.cli.command("refresh-instagram")
+def refresh_instagram_command():
+    """Fetch the Instagram feed into the shared cache."""
+    posts = refresh_instagram_cache()
+    click.echo(f"cached {len(posts)} post(s)")
+
+
+def read_log_tail(path: str, max_lines: int = 200, block_size: int = 8192):
+    """Return the last ``max_lines`` lines, reading backwards from the end of the file."""
     if not os.path.exists(path):
         return []
-    with open(path, "r", encoding="utf-8", errors="ignore") as f:
-        lines = f.readlines()[-max_lines:]
-    return lines
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        pos = f.tell()
+        data = b""
+        while pos > 0 and data.count(b"\n") <= max_lines:
+            step = min(block_size, pos)
+            pos -= step
+            f.seek(pos)
+            data = f.read(step) + data
+    return data.decode("utf-8", errors="ignore").splitlines(keepends=True)[-max_lines:]
+
+
+LOG_PATHS = {
+    "access": os.environ.get("ACCESS_LOG", "/var/log/www.kimqbeauty.com.access.log"),
+    "error": os.environ.get("ERROR_LOG", "/var/log/www.kimqbeauty.com.error.log"),
+    "server": os.environ.get("SERVER_LOG", "/var/log/www.kimqbeauty.com.server.log"),
+}
+# Upper bound on new log bytes parsed per indexing pass. Passes run from the
+# index-logs command, never from a request.
+LOG_INDEX_MAX_BYTES = 8 * 1024 * 1024
+LOG_INDEX_POLL_SECONDS = 60
+ACCESS_LOG_PATTERN = re.compile(r'\[(\d{2}/\w{3}/\d{4}):[^\]]*\] "[A-Z]+ ([^ "?]+)')
+
+
+def index_access_log(path: str, max_bytes: int = LOG_INDEX_MAX_BYTES) -> int:
+    """Fold access-log lines appended since the last run into per-day/per-path counters.
+
+    The byte offset and inode are stored in ``log_offsets``; a new inode or a
+    shorter file means the log was rotated and indexing restarts at zero.
+    Returns the number of bytes consumed.
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return 0
+    conn = connect_db()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        row = conn.execute("SELECT inode, byte_offset FROM log_offsets WHERE path=?", (path,)).fetchone()
+        offset = 0
+        if row and row["inode"] == stat.st_ino and row["byte_offset"] <= stat.st_size:
+            offset = row["byte_offset"]
+        if offset >= stat.st_size:
+            conn.rollback()
+            return 0
+        with open(path, "rb") as f:
+            f.seek(offset)
+            chunk = f.read(max_bytes)
+        end = chunk.rfind(b"\n")
+        if end < 0 and len(chunk) < max_bytes:
+            # Only a partial line so far; wait for the writer to finish it.
+            conn.rollback()
+            return 0
+        chunk = chunk[: end + 1] if end >= 0 else chunk
+        counts = Counter()
+        for line in chunk.decode("utf-8", errors="ignore").splitlines():
+            match = ACCESS_LOG_PATTERN.search(line)
+            if not match:
+                continue
+            try:
+                day = datetime.strptime(match.group(1), "%d/%b/%Y").date().isoformat()
+            except ValueError:
+                continue
+            counts[(day, match.group(2))] += 1
+        conn.executemany(
+            "INSERT INTO access_log_hits (day, path, hits) VALUES (?, ?, ?) ON CONFLICT(day, path) DO UPDATE SET hits = hits + excluded.hits",
+            [(day, req_path, hits) for (day, req_path), hits in counts.items()],
+        )
+        conn.execute(
+            """
+            INSERT INTO log_offsets (path, inode, byte_offset, updated_at) VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+            ON CONFLICT(path) DO UPDATE SET inode=excluded.inode, byte_offset=excluded.byte_offset, updated_at=excluded.updated_at
+            """,
+            (path, stat.st_ino, offset + len(chunk)),
+        )
+        conn.commit()
+        return len(chunk)
+    finally:
+        conn.close()
 
 
 def summarize_logs():
-    log_paths = {
-        "access": os.environ.get("ACCESS_LOG", "/var/log/www.kimqbeauty.com.access.log"),
-        "error": os.environ.get("ERROR_LOG", "/var/log/www.kimqbeauty.com.error.log"),
-        "server": os.environ.get("SERVER_LOG", "/var/log/www.kimqbeauty.com.server.log"),
-    }
+    """Each log's last few lines, plus today's access counters as of the last index-logs run."""
     metrics = {}
-    for kind, path in log_paths.items():
-        tail = read_log_tail(path)
+    for kind, path in LOG_PATHS.items():
+        tail = read_log_tail(path, max_lines=5)
         metrics[kind] = {
             "path": path,
             "lines": len(tail),
-            "recent": tail[-5:] if tail else [],
+            "recent": tail,
         }
-        if kind == "access" and tail:
-            metrics[kind]["today_hits"] = sum(1 for line in tail if datetime.utcnow().strftime("%d/%b/%Y") in line)
+    today = datetime.utcnow().date().isoformat()
+    conn = get_db()
+    indexed = conn.execute("SELECT updated_at FROM log_offsets WHERE path=?", (LOG_PATHS["access"],)).fetchone()
+    metrics["access"]["indexed_at"] = indexed["updated_at"] if indexed else None
+    metrics["access"]["today_hits"] = conn.execute(
+        "SELECT COALESCE(SUM(hits), 0) FROM access_log_hits WHERE day=?", (today,)
+    ).fetchone()[0]
+    metrics["access"]["top_paths"] = conn.execute(
+        "SELECT path, hits FROM access_log_hits WHERE day=? ORDER BY hits DESC LIMIT 5", (today,)
+    ).fetchall()
     return metrics
 
 
+@app.cli.command("index-logs")
+@click.option("--loop", is_flag=True, help=f"Keep indexing every {LOG_INDEX_POLL_SECONDS} seconds instead of exiting.")
+@click.option("--max-bytes", default=LOG_INDEX_MAX_BYTES, show_default=True)
+def index_logs_command(loop, max_bytes):
+    """Catch the access-log counters /admin shows up with the log file."""
+    while True:
+        total = 0
+        while True:
+            consumed = index_access_log(LOG_PATHS["access"], max_bytes)
+            if not consumed:
+                break
+            total += consumed
+        if total or not loop:
+            click.echo(f"indexed {total} byte(s) of {LOG_PATHS['access']}")
+        if not loop:
+            break
+        time.sleep(LOG_INDEX_POLL_SECONDS)
+
+
 def issue_reset_token(user_id: int) -> str:
     token = secrets.token_urlsafe(32)
     expires_at = (datetime.utcnow() + timedelta(hours=1)).isoformat()
@@ -569,8 +2119,6 @@ def issue_reset_token(user_id: int) -> str:
         "INSERT INTO password_resets (user_id, token, expires_at) VALUES (?, ?, ?)",
         (user_id, token, expires_at),
     )
-    conn.commit()
-    conn.close()
     return token
 
 
@@ -583,7 +2131,6 @@ def validate_reset_token(token: str):
         "SELECT pr.*, u.email, u.name FROM password_resets pr JOIN users u ON pr.user_id=u.id WHERE pr.token=?",
         (token,),
     ).fetchone()
-    conn.close()
     if not row or row["expires_at"] < now_iso:
         return None
     return row
@@ -594,55 +2141,912 @@ def generate_gift_code() -> str:
     return "KQ-" + "".join(secrets.choice(alphabet) for _ in range(8))
 
 
-def get_setting(key: str, default: str = "") -> str:
+# Seconds a worker trusts its cached settings before re-reading the version stamp.
+SETTINGS_CHECK_SECONDS = 30
+SETTINGS_VERSION_SQL = "SELECT COALESCE(MAX(updated_at), '') FROM site_settings"
+_settings_cache = {"values": None, "version": None, "checked_at": 0.0}
+
+
+def load_settings():
+    """Return all site settings, re-reading them only when their version changes.
+
+    The version is the newest ``site_settings.updated_at``; it is checked at
+    most every SETTINGS_CHECK_SECONDS, so edits made by another worker show up
+    within that window without a query on every page view.
+    """
+    now = time.monotonic()
+    cache = _settings_cache
+    if cache["values"] is not None and now - cache["checked_at"] < SETTINGS_CHECK_SECONDS:
+        return cache["values"]
     conn = get_db()
-    row = conn.execute("SELECT value FROM site_settings WHERE key=?", (key,)).fetchone()
-    conn.close()
-    return row["value"] if row else default
+    version = conn.execute(SETTINGS_VERSION_SQL).fetchone()[0]
+    if cache["values"] is None or version != cache["version"]:
+        rows = conn.execute("SELECT key, value FROM site_settings").fetchall()
+        cache["values"] = {row["key"]: row["value"] for row in rows}
+        cache["version"] = version
+    cache["checked_at"] = now
+    return cache["values"]
+
+
+def invalidate_settings():
+    _settings_cache["values"] = None
 
 
-def slot_taken(conn, employee_id: int, start_at: datetime) -> bool:
-    end_at = start_at + timedelta(hours=1)
+def get_setting(key: str, default: str = "") -> str:
+    value = load_settings().get(key)
+    return value if value is not None else default
+
+
+SLOT_STEP = timedelta(minutes=30)
+SLOT_LENGTH = timedelta(hours=1)
+# Longest footprint a single appointment may have; bounds the index range scan
+# when looking for appointments that spill into a day.
+MAX_APPOINTMENT_LENGTH = timedelta(hours=24)
+
+
+def service_footprint(service) -> timedelta:
+    """How long an appointment for ``service`` keeps the artist occupied."""
+    if not service:
+        return SLOT_LENGTH
+    minutes = (service["duration_minutes"] or 0) + (service["processing_minutes"] or 0) + (service["block_minutes"] or 0)
+    return timedelta(minutes=minutes) if minutes > 0 else SLOT_LENGTH
+
+
+def slot_taken(conn, employee_id: int, start_at: datetime, length: timedelta = SLOT_LENGTH) -> bool:
+    """True if an appointment or an unexpired hold overlaps the window."""
+    end_at = start_at + length
     overlap = conn.execute(
         """
         SELECT 1 FROM appointments
-        WHERE employee_id=? AND datetime(start_time) < datetime(?) AND datetime(start_time, '+1 hour') > datetime(?)
+        WHERE employee_id=? AND start_time > ? AND start_time < ? AND end_time > ?
+        UNION ALL
+        SELECT 1 FROM slot_holds
+        WHERE employee_id=? AND expires_at > ? AND start_time < ? AND end_time > ?
+        LIMIT 1
         """,
-        (employee_id, end_at.isoformat(), start_at.isoformat()),
+        (
+            employee_id,
+            to_db_time(start_at - MAX_APPOINTMENT_LENGTH),
+            to_db_time(end_at),
+            to_db_time(start_at),
+            employee_id,
+            to_db_time(datetime.utcnow()),
+            to_db_time(end_at),
+            to_db_time(start_at),
+        ),
     ).fetchone()
     return overlap is not None
 
 
-def within_time_off(conn, employee_id: int, start_at: datetime) -> bool:
-    end_at = start_at + timedelta(hours=1)
+# How long a claimed slot stays reserved while the deposit is being created.
+HOLD_SECONDS = 10 * 60
+
+
+def claim_slot(conn, employee_id: int, start_at: datetime, length: timedelta = SLOT_LENGTH,
+               submission_token: str | None = None):
+    """Atomically reserve ``[start_at, start_at + length)`` for ``employee_id``.
+
+    The overlap check and the hold insert share one short BEGIN IMMEDIATE
+    transaction, so concurrent bookings (threads or worker processes) only
+    serialize for that check. Expired holds are swept first. Returns the
+    hold id, or None when the window is taken. ``submission_token`` ties the
+    hold to the booking form that made it (see submission_in_flight).
+    """
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        now = datetime.utcnow()
+        conn.execute("DELETE FROM slot_holds WHERE expires_at <= ?", (to_db_time(now),))
+        if slot_taken(conn, employee_id, start_at, length) or within_time_off(conn, employee_id, start_at, length):
+            conn.rollback()
+            return None
+        hold = conn.execute(
+            "INSERT INTO slot_holds (employee_id, start_time, end_time, expires_at, submission_token) VALUES (?, ?, ?, ?, ?)",
+            (
+                employee_id,
+                to_db_time(start_at),
+                to_db_time(start_at + length),
+                to_db_time(now + timedelta(seconds=HOLD_SECONDS)),
+                submission_token,
+            ),
+        )
+        conn.commit()
+        return hold.lastrowid
+    except sqlite3.IntegrityError:
+        conn.rollback()
+        return None
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def release_slot(conn, hold_id: int):
+    conn.execute("DELETE FROM slot_holds WHERE id=?", (hold_id,))
+    conn.commit()
+
+
+# How often the "booking in progress" page reloads while an earlier copy of
+# the same form is still booking; the handler itself never waits for it.
+SUBMISSION_REFRESH_SECONDS = 2
+
+
+def submitted_booking(conn, submission_token: str):
+    return conn.execute(
+        "SELECT a.id FROM payments p JOIN appointments a ON a.payment_intent_id = p.payment_intent_id "
+        "WHERE p.submission_token=?",
+        (submission_token,),
+    ).fetchone()
+
+
+def submission_in_flight(conn, submission_token: str) -> bool:
+    return conn.execute(
+        "SELECT 1 FROM slot_holds WHERE submission_token=? AND expires_at > ?",
+        (submission_token, to_db_time(datetime.utcnow())),
+    ).fetchone() is not None
+
+
+
+def within_time_off(conn, employee_id: int, start_at: datetime, length: timedelta = SLOT_LENGTH) -> bool:
+    end_at = start_at + length
     block = conn.execute(
         """
         SELECT 1 FROM time_off
-        WHERE employee_id=? AND datetime(start_time) <= datetime(?) AND datetime(end_time) >= datetime(?)
+        WHERE employee_id=? AND end_time >= ? AND start_time <= ?
         """,
-        (employee_id, start_at.isoformat(), end_at.isoformat()),
+        (employee_id, to_db_time(end_at), to_db_time(start_at)),
     ).fetchone()
     return block is not None
 
 
-def available_slots_for_employee(conn, employee_id: int, day: date):
-    weekday = day.weekday()
-    avail_blocks = conn.execute(
-        "SELECT * FROM availability WHERE employee_id=? AND weekday=?",
-        (employee_id, weekday),
+def load_occupancy(conn, employee_ids, start_at: datetime, end_at: datetime):
+    """Fetch everything that can block a slot in ``[start_at, end_at)`` in a single query.
+
+    Returns ``{employee_id: (busy, blocked)}``: merged appointment and hold
+    intervals that a slot may not overlap, and time-off intervals that block a
+    slot they fully contain.
+    """
+    employee_ids = list(employee_ids)
+    occupancy = {emp_id: ([], []) for emp_id in employee_ids}
+    if not employee_ids:
+        return occupancy
+    marks = ",".join("?" * len(employee_ids))
+    rows = conn.execute(
+        f"""
+        SELECT 'appointment' AS kind, employee_id, start_time AS start_at, end_time AS end_at
+        FROM appointments
+        WHERE employee_id IN ({marks}) AND start_time > ? AND start_time < ? AND end_time > ?
+        UNION ALL
+        SELECT 'time_off' AS kind, employee_id, start_time AS start_at, end_time AS end_at
+        FROM time_off
+        WHERE employee_id IN ({marks}) AND end_time > ? AND start_time < ?
+        UNION ALL
+        SELECT 'hold' AS kind, employee_id, start_time AS start_at, end_time AS end_at
+        FROM slot_holds
+        WHERE employee_id IN ({marks}) AND expires_at > ? AND start_time < ? AND end_time > ?
+        """,
+        (
+            *employee_ids,
+            to_db_time(start_at - MAX_APPOINTMENT_LENGTH),
+            to_db_time(end_at),
+            to_db_time(start_at),
+            *employee_ids,
+            to_db_time(start_at),
+            to_db_time(end_at),
+            *employee_ids,
+            to_db_time(datetime.utcnow()),
+            to_db_time(end_at),
+            to_db_time(start_at),
+        ),
     ).fetchall()
+    for row in rows:
+        busy, blocked = occupancy[row["employee_id"]]
+        interval = (datetime.fromisoformat(row["start_at"]), datetime.fromisoformat(row["end_at"]))
+        (blocked if row["kind"] == "time_off" else busy).append(interval)
+    return {emp_id: (merge_intervals(busy), blocked) for emp_id, (busy, blocked) in occupancy.items()}
+
+
+def load_day_occupancy(conn, employee_id: int, day: date):
+    day_start = datetime.combine(day, datetime.min.time())
+    return load_occupancy(conn, [employee_id], day_start, day_start + timedelta(days=1))[employee_id]
+
+
+def intervals_overlapping(intervals, start_at: datetime, end_at: datetime):
+    return [interval for interval in intervals if interval[0] < end_at and interval[1] > start_at]
+
+
+def merge_intervals(intervals):
+    merged = []
+    for start_at, end_at in sorted(intervals):
+        if merged and start_at <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end_at))
+        else:
+            merged.append((start_at, end_at))
+    return merged
+
+
+def free_slots(day: date, avail_blocks, busy, blocked, length: timedelta = SLOT_LENGTH):
+    """Subtract ``busy``/``blocked`` intervals from the day's availability blocks.
+
+    A slot is ``length`` long, so longer services only fit where the whole
+    footprint is clear.
+    """
     slots = []
     for block in avail_blocks:
         start_t = datetime.combine(day, datetime.strptime(block["start_time"], "%H:%M").time())
         end_t = datetime.combine(day, datetime.strptime(block["end_time"], "%H:%M").time())
         cursor = start_t
-        while cursor + timedelta(minutes=60) <= end_t:
-            if not slot_taken(conn, employee_id, cursor) and not within_time_off(conn, employee_id, cursor):
+        i = 0
+        while cursor + length <= end_t:
+            slot_end = cursor + length
+            while i < len(busy) and busy[i][1] <= cursor:
+                i += 1
+            taken = i < len(busy) and busy[i][0] < slot_end
+            off = any(off_start <= cursor and off_end >= slot_end for off_start, off_end in blocked)
+            if not taken and not off:
                 slots.append(cursor)
-            cursor += timedelta(minutes=30)
+            cursor += SLOT_STEP
     return slots
 
 
+def available_slots_for_employee(conn, employee_id: int, day: date, length: timedelta = SLOT_LENGTH):
+    avail_blocks = conn.execute(
+        "SELECT * FROM availability WHERE employee_id=? AND weekday=?",
+        (employee_id, day.weekday()),
+    ).fetchall()
+    if not avail_blocks:
+        return []
+    busy, blocked = load_day_occupancy(conn, employee_id, day)
+    return free_slots(day, avail_blocks, busy, blocked, length)
+
+
+def available_slots_for_range(conn, employee_ids, first_day: date, last_day: date, length: timedelta = SLOT_LENGTH):
+    """Open slots for every employee and day in ``[first_day, last_day]``.
+
+    Availability rows and occupancy are each loaded once for the whole window.
+    Returns ``{employee_id: {day: [slot datetimes]}}``.
+    """
+    employee_ids = list(employee_ids)
+    window_start = datetime.combine(first_day, datetime.min.time())
+    window_end = datetime.combine(last_day + timedelta(days=1), datetime.min.time())
+    blocks_by_weekday = {}
+    if employee_ids:
+        rows = conn.execute(
+            f"SELECT * FROM availability WHERE employee_id IN ({','.join('?' * len(employee_ids))})",
+            employee_ids,
+        ).fetchall()
+        for row in rows:
+            blocks_by_weekday.setdefault((row["employee_id"], row["weekday"]), []).append(row)
+    occupancy = load_occupancy(conn, employee_ids, window_start, window_end)
+    results = {}
+    for emp_id in employee_ids:
+        busy, blocked = occupancy[emp_id]
+        days = results[emp_id] = {}
+        day = first_day
+        while day <= last_day:
+            avail_blocks = blocks_by_weekday.get((emp_id, day.weekday()))
+            if avail_blocks:
+                day_start = datetime.combine(day, datetime.min.time())
+                day_end = day_start + timedelta(days=1)
+                days[day] = free_slots(
+                    day,
+                    avail_blocks,
+                    intervals_overlapping(busy, day_start, day_end),
+                    intervals_overlapping(blocked, day_start, day_end),
+                    length,
+                )
+            else:
+                days[day] = []
+            day += timedelta(days=1)
+    return results
+
+
+def rank_employees_for_slot(conn, start_at: datetime, length: timedelta = SLOT_LENGTH, policy: str | None = None):
+    """Employees free for ``[start_at, start_at + length)``, best candidate first.
+
+    A single query checks every employee at once: the window must sit on an
+    availability block's 30-minute grid, and be clear of appointments, active
+    holds and covering time-off. It also returns each candidate's bookings
+    that day and the round-robin cursor for the ordering policy.
+    """
+    end_at = start_at + length
+    if end_at.date() != start_at.date():
+        # Availability blocks never run past midnight.
+        return []
+    day_start = datetime.combine(start_at.date(), datetime.min.time())
+    rows = conn.execute(
+        """
+        SELECT u.id,
+            (SELECT COUNT(*) FROM appointments a
+             WHERE a.employee_id=u.id AND a.start_time >= ? AND a.start_time < ?) AS booked_today,
+            (SELECT CAST(value AS INTEGER) FROM site_settings WHERE key='any_artist_cursor') AS cursor
+        FROM users u
+        WHERE u.role IN ('employee','admin')
+            AND EXISTS (
+                SELECT 1 FROM availability av
+                WHERE av.employee_id=u.id AND av.weekday=? AND av.start_time <= ? AND av.end_time >= ?
+                    AND (? - (CAST(substr(av.start_time, 1, 2) AS INTEGER) * 60 + CAST(substr(av.start_time, 4, 2) AS INTEGER))) % ? = 0
+            )
+            AND NOT EXISTS (
+                SELECT 1 FROM appointments a
+                WHERE a.employee_id=u.id AND a.start_time > ? AND a.start_time < ? AND a.end_time > ?
+            )
+            AND NOT EXISTS (
+                SELECT 1 FROM slot_holds h
+                WHERE h.employee_id=u.id AND h.expires_at > ? AND h.start_time < ? AND h.end_time > ?
+            )
+            AND NOT EXISTS (
+                SELECT 1 FROM time_off t
+                WHERE t.employee_id=u.id AND t.end_time >= ? AND t.start_time <= ?
+            )
+        """,
+        (
+            to_db_time(day_start),
+            to_db_time(day_start + timedelta(days=1)),
+            start_at.weekday(),
+            start_at.strftime("%H:%M"),
+            end_at.strftime("%H:%M"),
+            start_at.hour * 60 + start_at.minute,
+            int(SLOT_STEP.total_seconds() // 60),
+            to_db_time(start_at - MAX_APPOINTMENT_LENGTH),
+            to_db_time(end_at),
+            to_db_time(start_at),
+            to_db_time(datetime.utcnow()),
+            to_db_time(end_at),
+            to_db_time(start_at),
+            to_db_time(end_at),
+            to_db_time(start_at),
+        ),
+    ).fetchall()
+    policy = policy or app.config["ANY_ARTIST_POLICY"]
+    if policy == "round_robin":
+        cursor = (rows[0]["cursor"] if rows else None) or 0
+        return [row["id"] for row in sorted(rows, key=lambda row: (row["id"] <= cursor, row["id"]))]
+    if policy == "preferred":
+        rank = {emp_id: i for i, emp_id in enumerate(app.config["ANY_ARTIST_PREFERRED"])}
+        return [
+            row["id"]
+            for row in sorted(rows, key=lambda row: (rank.get(row["id"], len(rank)), row["booked_today"], row["id"]))
+        ]
+    return [row["id"] for row in sorted(rows, key=lambda row: (row["booked_today"], row["id"]))]
+
+
+def record_any_artist_assignment(conn, employee_id: int):
+    """Advance the round-robin cursor; leaves updated_at alone so settings caches stay warm."""
+    conn.execute(
+        "INSERT INTO site_settings (key, value) VALUES ('any_artist_cursor', ?) ON CONFLICT(key) DO UPDATE SET value=excluded.value",
+        (str(employee_id),),
+    )
+
+
+NEXT_AVAILABLE_FIRST_WINDOW_DAYS = 7
+
+
+def next_available_slots(conn, employee_ids, length: timedelta = SLOT_LENGTH, after=None, limit: int = 5, horizon_days: int = 90):
+    """First ``limit`` open slots at or after ``after`` across ``employee_ids``.
+
+    Windows double in size (a week, then two, four...), so a 90-day search is
+    at most a handful of range loads. Each window's per-employee slot lists are
+    merged through a heap and the search stops as soon as ``limit`` are found.
+    Returns ``[(slot_datetime, employee_id)]`` in chronological order.
+    """
+    employee_ids = list(employee_ids)
+    after = after or datetime.now()
+    first_day = after.date()
+    last_day = first_day + timedelta(days=horizon_days - 1)
+    window_days = NEXT_AVAILABLE_FIRST_WINDOW_DAYS
+    found = []
+    while employee_ids and first_day <= last_day and len(found) < limit:
+        window_end = min(first_day + timedelta(days=window_days - 1), last_day)
+        by_employee = available_slots_for_range(conn, employee_ids, first_day, window_end, length)
+        streams = [
+            [(slot, emp_id) for slot in sorted({slot for slots in by_employee[emp_id].values() for slot in slots})]
+            for emp_id in employee_ids
+        ]
+        for slot, emp_id in heapq.merge(*streams):
+            if slot < after:
+                continue
+            found.append((slot, emp_id))
+            if len(found) == limit:
+                break
+        first_day = window_end + timedelta(days=1)
+        window_days *= 2
+    return found
+
+
+# ---------- Occupancy bitmaps ----------
+
+# Each employee-day is stored as two bitsets of 5-minute cells: ``busy`` marks
+# cells an appointment touches, ``time_off`` marks cells time-off fully covers.
+# Like within_time_off, a slot is only off when a single time-off row covers
+# it, so ``time_off`` is the union pre-filter and the day's rows decide.
+# Times on the 5-minute grid give exactly the same slots as the SQL engine.
+OCCUPANCY_CELL_MINUTES = 5
+OCCUPANCY_CELLS = 24 * 60 // OCCUPANCY_CELL_MINUTES
+OCCUPANCY_BYTES = OCCUPANCY_CELLS // 8
+
+
+def occupancy_mask(day_start: datetime, start_at: datetime, end_at: datetime, covered: bool = False) -> int:
+    """Bits for the cells of the day at ``day_start`` that ``[start_at, end_at)`` touches.
+
+    With ``covered=True`` only cells lying entirely inside the interval are set.
+    """
+    cell = timedelta(minutes=OCCUPANCY_CELL_MINUTES)
+    first = max((start_at - day_start) / cell, 0)
+    last = min((end_at - day_start) / cell, OCCUPANCY_CELLS)
+    if covered:
+        first, last = -int(-first // 1), int(last // 1)
+    else:
+        first, last = int(first // 1), -int(-last // 1)
+    if last <= first:
+        return 0
+    return ((1 << (last - first)) - 1) << first
+
+
+def interval_days(start_at: datetime, end_at: datetime):
+    day = start_at.date()
+    while datetime.combine(day, datetime.min.time()) < end_at:
+        yield day
+        day += timedelta(days=1)
+
+
+def mark_occupancy(conn, employee_id: int, start_at: datetime, end_at: datetime, kind: str = "busy"):
+    """OR a new appointment (``busy``) or time-off interval into the stored bitmaps.
+
+    Call after inserting the source row so the caller already holds the write lock.
+    """
+    for day in interval_days(start_at, end_at):
+        day_start = datetime.combine(day, datetime.min.time())
+        mask = occupancy_mask(day_start, start_at, end_at, covered=kind == "time_off")
+        if not mask:
+            continue
+        row = conn.execute(
+            "SELECT busy, time_off FROM occupancy_days WHERE employee_id=? AND day=?",
+            (employee_id, day.isoformat()),
+        ).fetchone()
+        busy = int.from_bytes(row["busy"], "little") if row else 0
+        off = int.from_bytes(row["time_off"], "little") if row else 0
+        if kind == "time_off":
+            off |= mask
+        else:
+            busy |= mask
+        conn.execute(
+            "INSERT OR REPLACE INTO occupancy_days (employee_id, day, busy, time_off) VALUES (?, ?, ?, ?)",
+            (employee_id, day.isoformat(), busy.to_bytes(OCCUPANCY_BYTES, "little"), off.to_bytes(OCCUPANCY_BYTES, "little")),
+        )
+
+
+def occupancy_rows(conn, where: str = "", params=()):
+    """Compute bitmap rows from appointments and time-off, optionally filtered."""
+    rows = conn.execute(
+        f"""
+        SELECT 'busy' AS kind, employee_id, start_time, end_time FROM appointments WHERE employee_id IS NOT NULL {where}
+        UNION ALL
+        SELECT 'time_off' AS kind, employee_id, start_time, end_time FROM time_off WHERE employee_id IS NOT NULL {where}
+        """,
+        tuple(params) * 2,
+    ).fetchall()
+    masks = {}
+    for row in rows:
+        try:
+            start_at = datetime.fromisoformat(row["start_time"])
+            end_at = datetime.fromisoformat(row["end_time"])
+        except (TypeError, ValueError):
+            continue
+        for day in interval_days(start_at, end_at):
+            day_start = datetime.combine(day, datetime.min.time())
+            entry = masks.setdefault((row["employee_id"], day.isoformat()), [0, 0])
+            if row["kind"] == "time_off":
+                entry[1] |= occupancy_mask(day_start, start_at, end_at, covered=True)
+            else:
+                entry[0] |= occupancy_mask(day_start, start_at, end_at)
+    return [
+        (emp_id, day, busy.to_bytes(OCCUPANCY_BYTES, "little"), off.to_bytes(OCCUPANCY_BYTES, "little"))
+        for (emp_id, day), (busy, off) in masks.items()
+        if busy or off
+    ]
+
+
+def refresh_occupancy(conn, employee_id: int, days):
+    """Recompute the given employee-days from source rows (after deletes)."""
+    for day in set(days):
+        day_start = datetime.combine(day, datetime.min.time())
+        conn.execute("DELETE FROM occupancy_days WHERE employee_id=? AND day=?", (employee_id, day.isoformat()))
+        conn.executemany(
+            "INSERT INTO occupancy_days (employee_id, day, busy, time_off) VALUES (?, ?, ?, ?)",
+            [
+                row
+                for row in occupancy_rows(
+                    conn,
+                    "AND employee_id=? AND start_time < ? AND end_time > ?",
+                    (employee_id, to_db_time(day_start + timedelta(days=1)), to_db_time(day_start)),
+                )
+                if row[1] == day.isoformat()
+            ],
+        )
+
+
+def rebuild_occupancy(conn):
+    conn.execute("DELETE FROM occupancy_days")
+    conn.executemany("INSERT INTO occupancy_days (employee_id, day, busy, time_off) VALUES (?, ?, ?, ?)", occupancy_rows(conn))
+
+
+def available_slots_from_bitmaps(conn, employee_ids, day: date, length: timedelta = SLOT_LENGTH):
+    """Open slots for ``day`` by scanning the stored bitmaps, ``{employee_id: [slots]}``.
+
+    Four indexed lookups cover every employee: availability blocks, the day's
+    bitmaps, the (short-lived) slot holds and the day's time-off rows.
+    """
+    employee_ids = list(employee_ids)
+    results = {emp_id: [] for emp_id in employee_ids}
+    if not employee_ids:
+        return results
+    marks = ",".join("?" * len(employee_ids))
+    day_start = datetime.combine(day, datetime.min.time())
+    blocks = {}
+    for row in conn.execute(
+        f"SELECT * FROM availability WHERE employee_id IN ({marks}) AND weekday=?", (*employee_ids, day.weekday())
+    ):
+        blocks.setdefault(row["employee_id"], []).append(row)
+    bitmaps = {
+        row["employee_id"]: (int.from_bytes(row["busy"], "little"), int.from_bytes(row["time_off"], "little"))
+        for row in conn.execute(
+            f"SELECT * FROM occupancy_days WHERE employee_id IN ({marks}) AND day=?", (*employee_ids, day.isoformat())
+        )
+    }
+    holds = conn.execute(
+        f"SELECT * FROM slot_holds WHERE employee_id IN ({marks}) AND expires_at > ? AND start_time < ? AND end_time > ?",
+        (*employee_ids, to_db_time(datetime.utcnow()), to_db_time(day_start + timedelta(days=1)), to_db_time(day_start)),
+    ).fetchall()
+    for hold in holds:
+        busy, off = bitmaps.get(hold["employee_id"], (0, 0))
+        busy |= occupancy_mask(day_start, datetime.fromisoformat(hold["start_time"]), datetime.fromisoformat(hold["end_time"]))
+        bitmaps[hold["employee_id"]] = (busy, off)
+    off_rows = {}
+    for row in conn.execute(
+        f"SELECT employee_id, start_time, end_time FROM time_off WHERE employee_id IN ({marks}) AND end_time > ? AND start_time < ?",
+        (*employee_ids, to_db_time(day_start), to_db_time(day_start + timedelta(days=1))),
+    ):
+        off_rows.setdefault(row["employee_id"], []).append(
+            occupancy_mask(day_start, datetime.fromisoformat(row["start_time"]), datetime.fromisoformat(row["end_time"]), covered=True)
+        )
+    for emp_id, emp_blocks in blocks.items():
+        busy, off = bitmaps.get(emp_id, (0, 0))
+        emp_off_rows = off_rows.get(emp_id, ())
+        slots = results[emp_id]
+        for block in emp_blocks:
+            start_t = datetime.combine(day, datetime.strptime(block["start_time"], "%H:%M").time())
+            end_t = datetime.combine(day, datetime.strptime(block["end_time"], "%H:%M").time())
+            cursor = start_t
+            while cursor + length <= end_t:
+                mask = occupancy_mask(day_start, cursor, cursor + length)
+                off_here = off & mask == mask and any(row_mask & mask == mask for row_mask in emp_off_rows)
+                if not busy & mask and not off_here:
+                    slots.append(cursor)
+                cursor += SLOT_STEP
+    return results
+
+
+@app.cli.command("rebuild-occupancy")
+@click.option("--check-days", default=60, show_default=True, help="Days from today to compare against the SQL engine.")
+def rebuild_occupancy_command(check_days):
+    """Regenerate occupancy bitmaps and verify them against available_slots_for_employee."""
+    conn = connect_db()
+    conn.execute("BEGIN IMMEDIATE")
+    rebuild_occupancy(conn)
+    conn.commit()
+    employee_ids = [row["id"] for row in conn.execute("SELECT id FROM users WHERE role IN ('employee','admin')")]
+    lengths = {service_footprint(row) for row in conn.execute("SELECT * FROM services")} | {SLOT_LENGTH}
+    mismatches = 0
+    for offset in range(check_days):
+        day = date.today() + timedelta(days=offset)
+        for length in lengths:
+            from_bitmaps = available_slots_from_bitmaps(conn, employee_ids, day, length)
+            for emp_id in employee_ids:
+                expected = available_slots_for_employee(conn, emp_id, day, length)
+                if from_bitmaps[emp_id] != expected:
+                    mismatches += 1
+                    click.echo(f"mismatch: employee {emp_id} on {day} for {length}")
+    count = conn.execute("SELECT COUNT(*) FROM occupancy_days").fetchone()[0]
+    conn.close()
+    click.echo(f"rebuilt {count} employee-day bitmap(s); {mismatches} mismatch(es) over {check_days} day(s)")
+    if mismatches:
+        raise SystemExit(1)
+
+
+# ---------- Scale seeding ----------
+
+SEED_FIRST_NAMES = (
+    "Aisha", "Amira", "Bianca", "Camila", "Dana", "Elena", "Farah", "Grace", "Hana", "Imani",
+    "Jasmine", "Kayla", "Layla", "Mariam", "Nadia", "Olivia", "Priya", "Rania", "Salma", "Yasmin",
+)
+SEED_LAST_NAMES = (
+    "Ahmed", "Brown", "Chen", "Davis", "Garcia", "Haddad", "Johnson", "Khan", "Lopez", "Martin",
+    "Nguyen", "Patel", "Quraishi", "Rahman", "Smith", "Taylor", "Walker", "Williams", "Young", "Zaman",
+)
+SEED_NOTES = (
+    "Prefers a soft matte finish.",
+    "Sensitive skin - patch test new products.",
+    "Bringing two bridesmaids next visit.",
+    "Likes lashes on the natural side.",
+    "Running late last time; send an extra reminder.",
+    "Asked about the airbrush package.",
+)
+SEED_BATCH_SIZE = 5000
+
+
+def insert_batches(conn, sql, rows, batch_size=SEED_BATCH_SIZE):
+    """executemany ``rows`` (any iterable) in chunks so large volumes stay out of memory."""
+    batch = []
+    total = 0
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            conn.executemany(sql, batch)
+            total += len(batch)
+            batch.clear()
+    if batch:
+        conn.executemany(sql, batch)
+        total += len(batch)
+    return total
+
+
+def seed_scale(conn, employees=10, clients=10000, appointments=50000, gift_cards=2000, notes=20000,
+               time_off=500, per_day=6, days_ahead=90, seed=1125):
+    """Bulk-generate synthetic studio data on top of whatever ``conn`` already holds.
+
+    Appointments are packed back-to-back into each artist's working hours,
+    walking backwards from ``days_ahead`` days out until ``appointments`` rows
+    exist, so the volume decides how many years of history are produced. The
+    same ``seed`` always produces the same rows. Returns the row counts added.
+    """
+    rng = random.Random(seed)
+    now = datetime.now()
+    created_format = "%Y-%m-%d %H:%M:%S"
+    counts = {}
+
+    conn.execute("BEGIN IMMEDIATE")
+    staff = [row["id"] for row in conn.execute("SELECT id FROM users WHERE role IN ('employee','admin') ORDER BY id")]
+    password_hash = generate_password_hash("employeepass")
+    first_new = conn.execute("SELECT COALESCE(MAX(id), 0) FROM users").fetchone()[0] + 1
+    missing = max(employees - len(staff), 0)
+    for n in range(first_new, first_new + missing):
+        cur = conn.execute(
+            "INSERT INTO users (name, email, phone, role, password_hash) VALUES (?, ?, ?, 'employee', ?)",
+            (f"{rng.choice(SEED_FIRST_NAMES)} {rng.choice(SEED_LAST_NAMES)}", f"artist{n}@seed.kimq", f"555-{n:04d}", password_hash),
+        )
+        conn.executemany(
+            "INSERT INTO availability (employee_id, weekday, start_time, end_time) VALUES (?, ?, ?, ?)",
+            [(cur.lastrowid, weekday, "08:00", "20:00") for weekday in range(5)] + [(cur.lastrowid, 5, "10:00", "16:00")],
+        )
+        staff.append(cur.lastrowid)
+    counts["employees"] = missing
+    hours = {}
+    for row in conn.execute("SELECT employee_id, weekday, start_time, end_time FROM availability"):
+        hours.setdefault((row["employee_id"], row["weekday"]), []).append((row["start_time"], row["end_time"]))
+    services = conn.execute("SELECT * FROM services").fetchall()
+    footprints = [(service, service_footprint(service)) for service in services]
+
+    # Estimate the history window up front so created_at dates land inside it.
+    last_day = date.today() + timedelta(days=days_ahead)
+    slots_per_week = sum(min(per_day, 12) for emp_id in staff for weekday in range(7) if (emp_id, weekday) in hours)
+    first_day = last_day - timedelta(days=7 * appointments // max(slots_per_week, 1) + 7)
+    history_seconds = max(int((now - datetime.combine(first_day, datetime.min.time())).total_seconds()), 1)
+
+    def created_at():
+        return (now - timedelta(seconds=rng.randrange(history_seconds))).strftime(created_format)
+
+    first_client = conn.execute("SELECT COALESCE(MAX(id), 0) FROM clients").fetchone()[0] + 1
+
+    def client_rows():
+        for n in range(first_client, first_client + clients):
+            first, last = rng.choice(SEED_FIRST_NAMES), rng.choice(SEED_LAST_NAMES)
+            yield (f"{first} {last}", f"{first}.{last}{n}@example.com".lower(), f"555-{n:07d}", "", created_at())
+
+    counts["clients"] = insert_batches(
+        conn, "INSERT INTO clients (name, email, phone, notes, created_at) VALUES (?, ?, ?, ?, ?)", client_rows()
+    )
+    client_emails = dict(conn.execute("SELECT id, email FROM clients"))
+    client_ids = list(client_emails)
+    if not client_ids or not footprints or not staff:
+        conn.commit()
+        return counts
+
+    payments = []
+
+    def appointment_rows():
+        made = 0
+        day = last_day
+        idle_days = 0
+        while made < appointments and idle_days < 14:
+            made_before = made
+            for emp_id in staff:
+                for open_at, close_at in hours.get((emp_id, day.weekday()), []):
+                    cursor = datetime.combine(day, datetime.strptime(open_at, "%H:%M").time())
+                    closes = datetime.combine(day, datetime.strptime(close_at, "%H:%M").time())
+                    for _ in range(per_day):
+                        if made >= appointments:
+                            return
+                        service, footprint = rng.choice(footprints)
+                        cursor += SLOT_STEP * rng.choice((0, 0, 1, 2))
+                        if cursor + footprint > closes:
+                            break
+                        client_id = rng.choice(client_ids)
+                        past = cursor < now
+                        status = "Booked" if not past else ("Cancelled" if rng.random() < 0.05 else "Completed")
+                        payment_status = "succeeded" if past else "requires_payment_method"
+                        intent = f"pi_seed_{seed}_{made}"
+                        booked_at = (min(cursor, now) - timedelta(days=rng.randint(1, 60))).strftime(created_format)
+                        payments.append((intent, service["deposit_cents"], payment_status, client_emails[client_id], "deposit", booked_at))
+                        yield (client_id, service["id"], emp_id, to_db_time(cursor), to_db_time(cursor + footprint), status,
+                               intent, payment_status, service["deposit_cents"], booked_at)
+                        made += 1
+                        cursor += footprint
+            idle_days = 0 if made > made_before else idle_days + 1
+            day -= timedelta(days=1)
+
+    counts["appointments"] = insert_batches(
+        conn,
+        """
+        INSERT INTO appointments (client_id, service_id, employee_id, start_time, end_time, status, payment_intent_id, payment_status, amount_cents, created_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        appointment_rows(),
+    )
+    counts["payments"] = insert_batches(
+        conn,
+        "INSERT INTO payments (payment_intent_id, amount_cents, status, client_email, category, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+        payments,
+    )
+
+    first_gift_card = conn.execute("SELECT COALESCE(MAX(id), 0) FROM gift_cards").fetchone()[0] + 1
+
+    def gift_card_rows():
+        for n in range(first_gift_card, first_gift_card + gift_cards):
+            amount = rng.choice((5000, 10000, 15000, 25000))
+            yield (f"SEED{seed}-{n:06d}", rng.choice(SEED_FIRST_NAMES), rng.choice(SEED_FIRST_NAMES), amount,
+                   rng.choice((amount, amount, amount // 2, 0)), "Enjoy!", f"gift{n}@example.com", "Active",
+                   f"pi_seed_{seed}_gift_{n}", created_at())
+
+    counts["gift_cards"] = insert_batches(
+        conn,
+        "INSERT INTO gift_cards (code, to_name, from_name, amount_cents, balance_cents, message, email, status, payment_intent_id, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        gift_card_rows(),
+    )
+    counts["notes"] = insert_batches(
+        conn,
+        "INSERT INTO client_notes (client_id, author_id, note, created_at) VALUES (?, ?, ?, ?)",
+        ((rng.choice(client_ids), rng.choice(staff), rng.choice(SEED_NOTES), created_at()) for _ in range(notes)),
+    )
+
+    def time_off_rows():
+        span = (last_day - first_day).days or 1
+        for _ in range(time_off):
+            starts = datetime.combine(first_day + timedelta(days=rng.randrange(span)), datetime.min.time())
+            yield (rng.choice(staff), to_db_time(starts), to_db_time(starts + timedelta(days=rng.choice((1, 1, 2, 7)))), "Seeded time off")
+
+    counts["time_off"] = insert_batches(
+        conn, "INSERT INTO time_off (employee_id, start_time, end_time, reason) VALUES (?, ?, ?, ?)", time_off_rows()
+    )
+    rebuild_occupancy(conn)
+    conn.commit()
+    return counts
+
+
+@app.cli.command("seed-scale")
+@click.option("--employees", default=10, show_default=True, help="Make sure at least this many artists exist.")
+@click.option("--clients", default=10000, show_default=True)
+@click.option("--appointments", default=50000, show_default=True)
+@click.option("--gift-cards", default=2000, show_default=True)
+@click.option("--notes", default=20000, show_default=True)
+@click.option("--time-off", default=500, show_default=True)
+@click.option("--per-day", default=6, show_default=True, help="Appointments per artist per working day.")
+@click.option("--days-ahead", default=90, show_default=True, help="How far into the future bookings extend.")
+@click.option("--seed", default=1125, show_default=True, help="Random seed; the same seed yields the same rows.")
+def seed_scale_command(employees, clients, appointments, gift_cards, notes, time_off, per_day, days_ahead, seed):
+    """Bulk-generate synthetic clients, bookings, payments, gift cards, notes and time off."""
+    conn = connect_db()
+    started = time.perf_counter()
+    counts = seed_scale(conn, employees, clients, appointments, gift_cards, notes, time_off, per_day, days_ahead, seed)
+    conn.close()
+    summary = ", ".join(f"{count} {name.replace('_', ' ')}" for name, count in counts.items())
+    click.echo(f"seeded {summary} in {time.perf_counter() - started:.1f}s")
+
+
+# ---------- Client search ----------
+
+CLIENT_SEARCH_LIMIT = 20
+CLIENT_SEARCH_MAX_TERMS = 8
+
+
+def client_search_query(text: str) -> str:
+    """Free text as an FTS5 query: every word must match the start of a token.
+
+    Email domains are dropped because only the part before "@" is indexed.
+    """
+    terms = re.findall(r"\w+", re.sub(r"@\S*", " ", text or ""))[:CLIENT_SEARCH_MAX_TERMS]
+    return " ".join(f'"{term}"*' for term in terms)
+
+
+def search_clients(conn, text: str, limit: int = CLIENT_SEARCH_LIMIT):
+    """Best-ranked clients for ``text`` by name, email, phone, profile notes and CRM notes."""
+    query = client_search_query(text)
+    if not query:
+        return []
+    return conn.execute(
+        """
+        SELECT c.id, c.name, c.email, c.phone, m.snippet
+        FROM (
+            SELECT rowid AS id, rank, snippet(client_search, -1, '', '', '…', 10) AS snippet
+            FROM client_search WHERE client_search MATCH ? ORDER BY rank LIMIT ?
+        ) m
+        JOIN clients c ON c.id = m.id
+        ORDER BY m.rank
+        """,
+        (query, limit),
+    ).fetchall()
+
+
+# ---------- Admin listings ----------
+
+# name -> (SELECT ... FROM, sort column, id column, page size). Lists run newest
+# first on (sort column, id); each sort column's index already orders its rows
+# by id within equal values, so any page is one index range, however deep.
+ADMIN_LISTS = {
+    "appointments": (
+        "SELECT a.*, s.name AS service_name, s.deposit_cents, u.name AS employee_name, c.name AS client_name "
+        "FROM appointments a LEFT JOIN services s ON a.service_id=s.id LEFT JOIN users u ON a.employee_id=u.id "
+        "LEFT JOIN clients c ON a.client_id=c.id",
+        "a.start_time",
+        "a.id",
+        20,
+    ),
+    "clients": ("SELECT * FROM clients", "created_at", "id", 50),
+    "gift_cards": ("SELECT * FROM gift_cards", "created_at", "id", 20),
+    "payments": (f"SELECT * FROM payments WHERE {CHARGED_PAYMENT}", "created_at", "id", 20),
+}
+ADMIN_PAGE_MAX = 200
+
+
+def encode_cursor(sort_value, row_id) -> str:
+    return f"{row_id}:{sort_value}"
+
+
+def decode_cursor(cursor: str | None):
+    """(sort value, id) from an encode_cursor string; None for a missing or malformed cursor."""
+    row_id, _, sort_value = (cursor or "").partition(":")
+    if not row_id.isdigit() or not sort_value:
+        return None
+    return sort_value, int(row_id)
+
+
+def admin_page(conn, name: str, cursor: str | None = None, limit: int | None = None):
+    """One page of an admin list and the cursor for the next one (None on the last page)."""
+    select, sort_column, id_column, page_size = ADMIN_LISTS[name]
+    limit = max(1, min(limit or page_size, ADMIN_PAGE_MAX))
+    after = decode_cursor(cursor)
+    joiner = "AND" if " WHERE " in select else "WHERE"
+    where = f" {joiner} ({sort_column}, {id_column}) < (?, ?)" if after else ""
+    rows = conn.execute(
+        f"{select}{where} ORDER BY {sort_column} DESC, {id_column} DESC LIMIT ?",
+        (*(after or ()), limit + 1),
+    ).fetchall()
+    if len(rows) <= limit:
+        return rows, None
+    last = rows[limit - 1]
+    sort_value = last[sort_column.split(".")[-1]]
+    return rows[:limit], encode_cursor(sort_value, last["id"]) if sort_value is not None else None
+
+
+def admin_page_url(name: str, cursor: str | None):
+    """The admin page with ``name`` moved to ``cursor`` (None for its newest page), other lists kept."""
+    # Only the lists' own cursors carry over; anything else (``_anchor``,
+    # ``_external``...) would be read by url_for as one of its options.
+    kept = {f"{other}_after" for other in ADMIN_LISTS if other != name}
+    args = {key: value for key, value in request.args.items() if key in kept}
+    if cursor:
+        args[f"{name}_after"] = cursor
+    return url_for("admin", **args, _anchor=name.replace("_", "-"))
+
+
 # ---------- Routes ----------
 
 
@@ -665,7 +3069,7 @@ def home():
             "text": "Booked hair + makeup for my sister’s wedding party. Everyone looked cohesive and felt seen.",
         },
     ]
-    live_instagram = fetch_instagram_posts(limit=9)
+    live_instagram = cached_instagram_posts(get_db())
     fallback_instagram = [
         {
             "image": "https://images.unsplash.com/photo-1509631171560-7e2e4ba0b82b?auto=format&fit=crop&w=600&q=80",
@@ -688,7 +3092,6 @@ def home():
 def services():
     conn = get_db()
     items = conn.execute("SELECT * FROM services ORDER BY id").fetchall()
-    conn.close()
     categories = sorted({(item["category"] or "Uncategorized") for item in items}) if items else []
     return render_template("services.html", services=items, categories=categories, format_currency=format_currency)
 
@@ -712,32 +3115,93 @@ def book():
         email = request.form.get("email")
         phone = request.form.get("phone")
         notes = request.form.get("notes")
+        submission_token = request.form.get("submission_token") or secrets.token_urlsafe(16)
+
+        def resubmitted():
+            # A double-submitted form returns whatever the first submission booked,
+            # or the page that waits for it while that request is still running.
+            booked = submitted_booking(conn, submission_token)
+            if booked:
+                flash("This booking was already submitted.", "success")
+                return redirect(url_for("appointment_detail", appointment_id=booked["id"]))
+            if submission_in_flight(conn, submission_token):
+                return redirect(url_for("booking_submitted", submission_token=submission_token))
+            return None
+
+        earlier = resubmitted()
+        if earlier:
+            return earlier
 
         service = conn.execute("SELECT * FROM services WHERE id=?", (service_id,)).fetchone()
         if not service:
             flash("Service not found.", "error")
-            conn.close()
             return redirect(url_for("book"))
 
         appt_datetime = datetime.fromisoformat(f"{date_str}T{time_str}")
+        footprint = service_footprint(service)
 
-        chosen_employee = employee_id
-        if not chosen_employee:
-            # pick first available
-            for emp in employees:
-                if appt_datetime in available_slots_for_employee(conn, emp["id"], appt_datetime.date()):
-                    chosen_employee = emp["id"]
+        chosen_employee = None
+        hold_id = None
+        if employee_id:
+            chosen_employee = employee_id
+            hold_id = claim_slot(conn, chosen_employee, appt_datetime, footprint, submission_token)
+        else:
+            candidates = rank_employees_for_slot(conn, appt_datetime, footprint)
+            if not candidates:
+                earlier = resubmitted()
+                if earlier:
+                    return earlier
+                flash("No availability for the selected time.", "error")
+                return redirect(url_for("book"))
+            for candidate in candidates:
+                hold_id = claim_slot(conn, candidate, appt_datetime, footprint, submission_token)
+                if hold_id:
+                    chosen_employee = candidate
                     break
-        if not chosen_employee:
-            flash("No availability for the selected time.", "error")
-            conn.close()
+        if not hold_id:
+            # The slot may have gone to a copy of this form submitted moments earlier.
+            earlier = resubmitted()
+            if earlier:
+                return earlier
+            flash("Selected time is no longer available.", "error")
             return redirect(url_for("book"))
 
-        if slot_taken(conn, chosen_employee, appt_datetime) or within_time_off(conn, chosen_employee, appt_datetime):
+        description = f"Deposit for {service['name']}"
+        payment = None
+        try:
+            payment = reserve_payment(conn, submission_token, service["deposit_cents"], email, "deposit")
+            payment_intent_id, payment_status = create_payment_intent(
+                amount_cents=service["deposit_cents"],
+                description=description,
+                customer_email=email,
+                idempotency_key=payment_idempotency_key(payment, description),
+            )
+        except Exception:
+            if payment:
+                abandon_payment(conn, payment["id"])
+            release_slot(conn, hold_id)
+            raise
+
+        conn.execute("BEGIN IMMEDIATE")
+        booked = conn.execute("SELECT id FROM appointments WHERE payment_intent_id=?", (payment_intent_id,)).fetchone()
+        if booked:
+            # A concurrent resubmission of the same form got there first.
+            conn.rollback()
+            release_slot(conn, hold_id)
+            return redirect(url_for("appointment_detail", appointment_id=booked["id"]))
+        # The hold only lapses if the payment call outlived HOLD_SECONDS; in that
+        # case someone else may have claimed the time in the meantime.
+        if not conn.execute("DELETE FROM slot_holds WHERE id=?", (hold_id,)).rowcount and (
+            slot_taken(conn, chosen_employee, appt_datetime, footprint)
+            or within_time_off(conn, chosen_employee, appt_datetime, footprint)
+        ):
+            conn.rollback()
+            abandon_payment(conn, payment["id"], payment_intent_id)
             flash("Selected time is no longer available.", "error")
-            conn.close()
             return redirect(url_for("book"))
 
+        if not employee_id:
+            record_any_artist_assignment(conn, chosen_employee)
         client = conn.execute("SELECT * FROM clients WHERE email=?", (email,)).fetchone()
         if not client:
             cur = conn.execute(
@@ -748,25 +3212,21 @@ def book():
         else:
             client_id = client["id"]
 
-        payment_intent_id, payment_status = create_payment_intent(
-            amount_cents=service["deposit_cents"],
-            description=f"Deposit for {service['name']}",
-            customer_email=email,
-        )
         conn.execute(
-            "INSERT INTO payments (payment_intent_id, amount_cents, status, client_email, category) VALUES (?, ?, ?, ?, ?)",
-            (payment_intent_id, service["deposit_cents"], payment_status, email, "deposit"),
+            "UPDATE payments SET payment_intent_id=?, status=? WHERE id=?",
+            (payment_intent_id, payment_status, payment["id"]),
         )
         appt = conn.execute(
             """
-            INSERT INTO appointments (client_id, service_id, employee_id, start_time, status, notes, payment_intent_id, payment_status, amount_cents)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            INSERT INTO appointments (client_id, service_id, employee_id, start_time, end_time, status, notes, payment_intent_id, payment_status, amount_cents)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
             """,
             (
                 client_id,
                 service_id,
                 chosen_employee,
-                appt_datetime.isoformat(),
+                to_db_time(appt_datetime),
+                to_db_time(appt_datetime + footprint),
                 "Booked",
                 notes,
                 payment_intent_id,
@@ -774,18 +3234,24 @@ def book():
                 service["deposit_cents"],
             ),
         )
-        conn.commit()
+        mark_occupancy(conn, chosen_employee, appt_datetime, appt_datetime + footprint)
         appt_id = appt.lastrowid
-
         email_body = f"<p>Hi {name},</p><p>Your appointment for {service['name']} is confirmed for {appt_datetime.strftime('%B %d, %Y %I:%M %p')}.</p><p>Deposit: {format_currency(service['deposit_cents'])}</p>"
-        send_email(email, "Appointment Confirmation", email_body)
+        queue_email(conn, email, "Appointment Confirmation", email_body)
+        if phone:
+            queue_sms(
+                conn,
+                phone,
+                f"Kim Quraishi Beauty Studio: your {service['name']} appointment is confirmed for {appt_datetime.strftime('%b %d at %I:%M %p')}.",
+            )
+        conn.commit()
+        notify_outbox()
         flash("Appointment booked and deposit captured. Confirmation sent via email.", "success")
-        conn.close()
         return redirect(url_for("appointment_detail", appointment_id=appt_id))
 
-    conn.close()
     return render_template(
         "book.html",
+        submission_token=secrets.token_urlsafe(16),
         services=services,
         employees=employees,
         selected_service=selected_service,
@@ -793,6 +3259,19 @@ def book():
     )
 
 
+@app.route("/book/submitted/<submission_token>")
+def booking_submitted(submission_token):
+    conn = get_db()
+    booked = submitted_booking(conn, submission_token)
+    if booked:
+        flash("This booking was already submitted.", "success")
+        return redirect(url_for("appointment_detail", appointment_id=booked["id"]))
+    if submission_in_flight(conn, submission_token):
+        return render_template("booking_pending.html"), 200, {"Refresh": str(SUBMISSION_REFRESH_SECONDS)}
+    flash("Your booking did not go through. Please try again.", "error")
+    return redirect(url_for("book"))
+
+
 @app.route("/appointment/<int:appointment_id>")
 def appointment_detail(appointment_id):
     conn = get_db()
@@ -807,7 +3286,6 @@ def appointment_detail(appointment_id):
         """,
         (appointment_id,),
     ).fetchone()
-    conn.close()
     if not appt:
         flash("Appointment not found.", "error")
         return redirect(url_for("home"))
@@ -823,9 +3301,27 @@ def gift_cards():
         message = request.form.get("message")
         email = request.form.get("email")
 
-        code = generate_gift_code()
-        payment_intent_id, payment_status = create_payment_intent(amount, "Gift Card", email)
         conn = get_db()
+        submission_token = request.form.get("submission_token") or secrets.token_urlsafe(16)
+        purchased = "SELECT 1 FROM payments p JOIN gift_cards g ON g.payment_intent_id = p.payment_intent_id WHERE p.id=?"
+        payment = reserve_payment(conn, submission_token, amount, email, "gift_card")
+        if conn.execute(purchased, (payment["id"],)).fetchone():
+            flash("This gift card was already purchased. We emailed the details.", "success")
+            return redirect(url_for("gift_cards"))
+
+        code = generate_gift_code()
+        try:
+            payment_intent_id, payment_status = create_payment_intent(
+                amount, "Gift Card", email, idempotency_key=payment_idempotency_key(payment, "Gift Card")
+            )
+        except Exception:
+            abandon_payment(conn, payment["id"])
+            raise
+        conn.execute("BEGIN IMMEDIATE")
+        if conn.execute(purchased, (payment["id"],)).fetchone():
+            conn.rollback()
+            flash("This gift card was already purchased. We emailed the details.", "success")
+            return redirect(url_for("gift_cards"))
         conn.execute(
             "INSERT INTO gift_cards (code, to_name, from_name, amount_cents, balance_cents, message, email, status, payment_intent_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
             (
@@ -841,19 +3337,20 @@ def gift_cards():
             ),
         )
         conn.execute(
-            "INSERT INTO payments (payment_intent_id, amount_cents, status, client_email, category) VALUES (?, ?, ?, ?, ?)",
-            (payment_intent_id, amount, payment_status, email, "gift_card"),
+            "UPDATE payments SET payment_intent_id=?, status=? WHERE id=?",
+            (payment_intent_id, payment_status, payment["id"]),
         )
-        conn.commit()
-        conn.close()
-        send_email(
+        queue_email(
+            conn,
             email,
             "Your Kim Quraishi Beauty Studio Gift Card",
             f"<p>Hi {to_name},</p><p>You received a gift card from {from_name} for {format_currency(amount)}.</p><p>Code: <strong>{code}</strong></p><p>Message: {message}</p>",
         )
+        conn.commit()
+        notify_outbox()
         flash("Gift card purchased! We emailed the details.", "success")
         return redirect(url_for("gift_cards"))
-    return render_template("gift_cards.html", format_currency=format_currency)
+    return render_template("gift_cards.html", submission_token=secrets.token_urlsafe(16), format_currency=format_currency)
 
 
 @app.route("/contact", methods=["GET", "POST"])
@@ -862,7 +3359,10 @@ def contact():
         name = request.form.get("name")
         email = request.form.get("email")
         message = request.form.get("message")
-        send_email("kim@studio.com", f"New inquiry from {name}", f"<p>From: {email}</p><p>{message}</p>")
+        conn = get_db()
+        queue_email(conn, "kim@studio.com", f"New inquiry from {name}", f"<p>From: {email}</p><p>{message}</p>")
+        conn.commit()
+        notify_outbox()
         flash("Thanks for reaching out. We'll respond shortly.", "success")
         return redirect(url_for("contact"))
     return render_template("contact.html")
@@ -875,18 +3375,20 @@ def login():
         email = request.form.get("email")
         conn = get_db()
         user = conn.execute("SELECT * FROM users WHERE email=?", (email,)).fetchone()
-        conn.close()
         if action == "send_link":
             if not user:
                 flash("No account found for that email.", "error")
                 return redirect(url_for("login"))
             token = issue_reset_token(user["id"])
             reset_link = url_for("reset_password", token=token, _external=True)
-            send_email(
+            queue_email(
+                conn,
                 email,
                 "Reset your Kim Quraishi password",
                 f"<p>Click below to reset your password:</p><p><a href='{reset_link}'>{reset_link}</a></p>",
             )
+            conn.commit()
+            notify_outbox()
             flash("Reset link sent. Check your email (and spam).", "success")
             return redirect(url_for("login"))
         password = request.form.get("password")
@@ -908,17 +3410,19 @@ def forgot_password():
         email = request.form.get("email")
         conn = get_db()
         user = conn.execute("SELECT * FROM users WHERE email=?", (email,)).fetchone()
-        conn.close()
         if not user:
             flash("We couldn't find that email.", "error")
             return redirect(url_for("forgot_password"))
         token = issue_reset_token(user["id"])
         reset_link = url_for("reset_password", token=token, _external=True)
-        send_email(
+        queue_email(
+            conn,
             email,
             "Reset your Kim Quraishi password",
             f"<p>Hi {user['name']},</p><p>Reset your password here: <a href='{reset_link}'>{reset_link}</a></p>",
         )
+        conn.commit()
+        notify_outbox()
         flash("Password reset link sent. Please check your inbox.", "success")
         return redirect(url_for("login"))
     return render_template("forgot_password.html")
@@ -939,7 +3443,6 @@ def reset_password(token):
         )
         conn.execute("DELETE FROM password_resets WHERE user_id=?", (row["user_id"],))
         conn.commit()
-        conn.close()
         flash("Password updated. You can log in now.", "success")
         return redirect(url_for("login"))
     return render_template("reset_password.html", token=token, email=row["email"])
@@ -956,7 +3459,6 @@ def signup():
         existing = conn.execute("SELECT id FROM users WHERE email=?", (email,)).fetchone()
         if existing:
             flash("Account already exists.", "error")
-            conn.close()
             return redirect(url_for("signup"))
         cur = conn.execute(
             "INSERT INTO users (name, email, phone, role, password_hash) VALUES (?, ?, ?, 'client', ?)",
@@ -968,7 +3470,6 @@ def signup():
         )
         conn.commit()
         session["user_id"] = cur.lastrowid
-        conn.close()
         flash("Account created.", "success")
         return redirect(url_for("home"))
     return render_template("signup.html")
@@ -989,7 +3490,7 @@ def billing():
         return redirect(url_for("login"))
     conn = get_db()
     payments = conn.execute(
-        "SELECT * FROM payments WHERE client_email=? ORDER BY datetime(created_at) DESC",
+        f"SELECT * FROM payments WHERE client_email=? AND {CHARGED_PAYMENT} ORDER BY created_at DESC",
         (user["email"],),
     ).fetchall()
     appointments = conn.execute(
@@ -999,11 +3500,10 @@ def billing():
         LEFT JOIN services s ON a.service_id=s.id
         LEFT JOIN clients c ON a.client_id=c.id
         WHERE c.email=?
-        ORDER BY datetime(a.start_time) DESC
+        ORDER BY a.start_time DESC
         """,
         (user["email"],),
     ).fetchall()
-    conn.close()
     return render_template("billing.html", payments=payments, appointments=appointments, format_currency=format_currency)
 
 
@@ -1017,27 +3517,32 @@ def admin():
     employees = conn.execute("SELECT * FROM users WHERE role IN ('employee','admin')").fetchall()
     services = conn.execute("SELECT * FROM services").fetchall()
     categories = sorted({(svc["category"] or "Uncategorized") for svc in services}) if services else []
-    appointments = conn.execute(
-        "SELECT a.*, s.name as service_name, s.deposit_cents, u.name as employee_name, c.name as client_name FROM appointments a LEFT JOIN services s ON a.service_id=s.id LEFT JOIN users u ON a.employee_id=u.id LEFT JOIN clients c ON a.client_id=c.id ORDER BY datetime(start_time) DESC LIMIT 20",
-    ).fetchall()
-    gift_cards = conn.execute("SELECT * FROM gift_cards ORDER BY created_at DESC LIMIT 20").fetchall()
-    clients = conn.execute("SELECT * FROM clients ORDER BY datetime(created_at) DESC LIMIT 50").fetchall()
+    lists = {}
+    pagers = {}
+    for name in ADMIN_LISTS:
+        cursor = request.args.get(f"{name}_after")
+        lists[name], next_cursor = admin_page(conn, name, cursor)
+        pagers[name] = {
+            "newest": admin_page_url(name, None) if cursor else None,
+            "older": admin_page_url(name, next_cursor) if next_cursor else None,
+        }
     earnings = conn.execute(
-        "SELECT COALESCE(SUM(amount_cents),0) as total, COUNT(*) as count FROM payments",
+        f"SELECT COALESCE(SUM(amount_cents),0) as total, COUNT(*) as count FROM payments WHERE {CHARGED_PAYMENT}",
     ).fetchone()
     upcoming_count = conn.execute(
-        "SELECT COUNT(*) as c FROM appointments WHERE datetime(start_time) >= datetime('now')",
+        "SELECT COUNT(*) as c FROM appointments WHERE start_time >= strftime('%Y-%m-%dT%H:%M:%S', 'now')",
     ).fetchone()["c"]
-    conn.close()
     log_metrics = summarize_logs()
     return render_template(
         "admin.html",
         employees=employees,
         services=services,
         categories=categories,
-        appointments=appointments,
-        gift_cards=gift_cards,
-        clients=clients,
+        appointments=lists["appointments"],
+        gift_cards=lists["gift_cards"],
+        clients=lists["clients"],
+        payments=lists["payments"],
+        pagers=pagers,
         format_currency=format_currency,
         announcement=get_setting("announcement", ""),
         earnings=earnings,
@@ -1045,6 +3550,58 @@ def admin():
         log_metrics=log_metrics,
     )
 
+
+@app.route("/api/admin/<list_name>")
+def api_admin_list(list_name):
+    if not require_role("admin"):
+        return jsonify({"error": "Admin access only."}), 403
+    if list_name not in ADMIN_LISTS:
+        return jsonify({"error": "Unknown list."}), 404
+    rows, next_cursor = admin_page(
+        get_db(), list_name, request.args.get("after"), request.args.get("limit", type=int)
+    )
+    return jsonify({"items": [dict(row) for row in rows], "next_cursor": next_cursor})
+
+
+@app.route("/metrics")
+def metrics():
+    token = request.headers.get("Authorization", "")
+    metrics_token = app.config["METRICS_TOKEN"]
+    if not (metrics_token and secrets.compare_digest(token, f"Bearer {metrics_token}")) and not require_role("admin"):
+        return "Forbidden", 403
+    flush_metrics(force=True)
+    return app.response_class(render_metrics(get_db()), mimetype="text/plain; version=0.0.4")
+
+
+@app.route("/admin/profiles")
+def admin_profiles():
+    if not require_role("admin"):
+        flash("Admin access only.", "error")
+        return redirect(url_for("login"))
+    profiles = list_profiles()
+    selected = request.args.get("view")
+    report = None
+    if selected in {profile["name"] for profile in profiles}:
+        report = profile_report(selected)
+    return render_template(
+        "admin_profiles.html",
+        profiles=profiles,
+        selected=selected,
+        report=report,
+        sample_rate=app.config["PROFILE_SAMPLE_RATE"],
+        max_files=app.config["PROFILE_MAX_FILES"],
+    )
+
+
+@app.route("/admin/profiles/<name>")
+def download_profile(name):
+    if not require_role("admin"):
+        flash("Admin access only.", "error")
+        return redirect(url_for("login"))
+    if not PROFILE_NAME_PATTERN.match(name):
+        return "Not found", 404
+    return send_from_directory(app.config["PROFILE_DIR"], name, as_attachment=True)
+
 # @app.route("/admin/announcement", methods=["POST"])
 # def update_announcement():
 #     if not require_role("admin"):
@@ -1068,11 +3625,11 @@ def update_announcement():
     message = request.form.get("announcement", "").strip()
     conn = get_db()
     conn.execute(
-        "INSERT INTO site_settings (key, value, updated_at) VALUES ('announcement', ?, CURRENT_TIMESTAMP) ON CONFLICT(key) DO UPDATE SET value=excluded.value, updated_at=CURRENT_TIMESTAMP",
+        "INSERT INTO site_settings (key, value, updated_at) VALUES ('announcement', ?, strftime('%Y-%m-%d %H:%M:%f', 'now')) ON CONFLICT(key) DO UPDATE SET value=excluded.value, updated_at=excluded.updated_at",
         (message,),
     )
     conn.commit()
-    conn.close()
+    invalidate_settings()
     flash("Announcement updated.", "success")
     return redirect(url_for("admin"))
 
@@ -1116,7 +3673,6 @@ def add_service():
         ),
     )
     conn.commit()
-    conn.close()
     flash("Service added.", "success")
     return redirect(url_for("admin"))
 
@@ -1126,10 +3682,19 @@ def delete_service(service_id):
     if not require_role("admin"):
         return redirect(url_for("login"))
     conn = get_db()
+    removed = conn.execute(
+        "SELECT employee_id, start_time, end_time FROM appointments WHERE service_id=? AND employee_id IS NOT NULL",
+        (service_id,),
+    ).fetchall()
     conn.execute("DELETE FROM appointments WHERE service_id=?", (service_id,))
     conn.execute("DELETE FROM services WHERE id=?", (service_id,))
+    affected = {}
+    for row in removed:
+        days = interval_days(datetime.fromisoformat(row["start_time"]), datetime.fromisoformat(row["end_time"]))
+        affected.setdefault(row["employee_id"], set()).update(days)
+    for emp_id, days in affected.items():
+        refresh_occupancy(conn, emp_id, days)
     conn.commit()
-    conn.close()
     flash("Service removed.", "success")
     return redirect(url_for("admin"))
 
@@ -1149,7 +3714,6 @@ def add_employee():
         (name, email, phone, generate_password_hash(password)),
     )
     conn.commit()
-    conn.close()
     flash(f"Employee {name} added.", "success")
     return redirect(url_for("admin"))
 
@@ -1193,7 +3757,6 @@ def update_service_pricing(service_id):
         ),
     )
     conn.commit()
-    conn.close()
     flash("Service pricing updated.", "success")
     return redirect(url_for("admin"))
 
@@ -1220,7 +3783,6 @@ def admin_availability():
         (employee_id, weekday, start_time_str, end_time_str),
     )
     conn.commit()
-    conn.close()
     flash("Availability saved.", "success")
     return redirect(url_for("admin"))
 
@@ -1230,16 +3792,18 @@ def admin_time_off():
     if not require_role("admin"):
         return redirect(url_for("login"))
     employee_id = int(request.form.get("employee_id"))
-    start_time_str = request.form.get("start_time")
-    end_time_str = request.form.get("end_time")
+    start_time_str = to_db_time(datetime.fromisoformat(request.form.get("start_time")))
+    end_time_str = to_db_time(datetime.fromisoformat(request.form.get("end_time")))
     reason = request.form.get("reason")
     conn = get_db()
     conn.execute(
         "INSERT INTO time_off (employee_id, start_time, end_time, reason) VALUES (?, ?, ?, ?)",
         (employee_id, start_time_str, end_time_str, reason),
     )
+    mark_occupancy(
+        conn, employee_id, datetime.fromisoformat(start_time_str), datetime.fromisoformat(end_time_str), "time_off"
+    )
     conn.commit()
-    conn.close()
     flash("Time off added.", "success")
     return redirect(url_for("admin"))
 
@@ -1258,12 +3822,11 @@ def employee_dashboard():
         FROM appointments a
         LEFT JOIN services s ON a.service_id=s.id
         LEFT JOIN clients c ON a.client_id=c.id
-        WHERE a.employee_id=? AND datetime(start_time) >= datetime(?)
-        ORDER BY datetime(start_time)
+        WHERE a.employee_id=? AND a.start_time >= ?
+        ORDER BY a.start_time
         """,
-        (user["id"], today.isoformat()),
+        (user["id"], to_db_time(datetime.combine(today, datetime.min.time()))),
     ).fetchall()
-    conn.close()
     return render_template("dashboard.html", appointments=upcoming)
 
 
@@ -1276,12 +3839,11 @@ def client_profile(client_id):
     conn = get_db()
     client = conn.execute("SELECT * FROM clients WHERE id=?", (client_id,)).fetchone()
     visits = conn.execute(
-        "SELECT a.*, s.name as service_name FROM appointments a LEFT JOIN services s ON a.service_id=s.id WHERE client_id=? ORDER BY datetime(start_time) DESC",
+        "SELECT a.*, s.name as service_name FROM appointments a LEFT JOIN services s ON a.service_id=s.id WHERE a.client_id=? ORDER BY a.start_time DESC",
         (client_id,),
     ).fetchall()
-    notes = conn.execute("SELECT n.*, u.name as author_name FROM client_notes n LEFT JOIN users u ON n.author_id=u.id WHERE client_id=? ORDER BY datetime(n.created_at) DESC", (client_id,)).fetchall()
+    notes = conn.execute("SELECT n.*, u.name as author_name FROM client_notes n LEFT JOIN users u ON n.author_id=u.id WHERE n.client_id=? ORDER BY n.created_at DESC", (client_id,)).fetchall()
     photos = conn.execute("SELECT * FROM client_photos WHERE client_id=? ORDER BY created_at DESC", (client_id,)).fetchall()
-    conn.close()
     return render_template(
         "client_profile.html", client=client, visits=visits, notes=notes, photos=photos
     )
@@ -1298,7 +3860,6 @@ def add_client_note(client_id):
         (client_id, current_user()["id"], note),
     )
     conn.commit()
-    conn.close()
     flash("Note added.", "success")
     return redirect(url_for("client_profile", client_id=client_id))
 
@@ -1307,16 +3868,24 @@ def add_client_note(client_id):
 def api_availability():
     date_str = request.args.get("date")
     employee_id = request.args.get("employee_id")
+    service_id = request.args.get("service_id", type=int)
     if not date_str:
         return jsonify([])
     day = datetime.fromisoformat(date_str).date()
     conn = get_db()
-    employees = conn.execute("SELECT * FROM users WHERE role IN ('employee','admin')").fetchall()
+    length = SLOT_LENGTH
+    if service_id:
+        service = conn.execute("SELECT * FROM services WHERE id=?", (service_id,)).fetchone()
+        length = service_footprint(service)
+    employees = [
+        emp
+        for emp in conn.execute("SELECT * FROM users WHERE role IN ('employee','admin')").fetchall()
+        if not employee_id or employee_id == "any" or int(employee_id) == emp["id"]
+    ]
+    by_employee = available_slots_from_bitmaps(conn, [emp["id"] for emp in employees], day, length)
     results = []
     for emp in employees:
-        if employee_id and employee_id != "any" and int(employee_id) != emp["id"]:
-            continue
-        slots = available_slots_for_employee(conn, emp["id"], day)
+        slots = by_employee[emp["id"]]
         results.append(
             {
                 "employee_id": emp["id"],
@@ -1327,10 +3896,134 @@ def api_availability():
                 ],
             }
         )
-    conn.close()
     return jsonify(results)
 
 
+@app.route("/api/clients/search")
+def api_client_search():
+    user = current_user()
+    if not user or user["role"] not in {"employee", "admin"}:
+        return jsonify({"error": "Restricted."}), 403
+    limit = max(1, min(request.args.get("limit", CLIENT_SEARCH_LIMIT, type=int), 50))
+    rows = search_clients(get_db(), request.args.get("q", ""), limit)
+    return jsonify(
+        {
+            "results": [
+                {
+                    "id": row["id"],
+                    "name": row["name"],
+                    "email": row["email"],
+                    "phone": row["phone"],
+                    "snippet": row["snippet"],
+                    "url": url_for("client_profile", client_id=row["id"]),
+                }
+                for row in rows
+            ]
+        }
+    )
+
+
+# Longest window /api/availability/range computes in one call.
+AVAILABILITY_RANGE_MAX_DAYS = 62
+
+
+@app.route("/api/availability/range")
+def api_availability_range():
+    """Per-day open-slot counts for a date window (``end`` inclusive).
+
+    ``include_slots=1`` adds each employee's slot times for every day.
+    """
+    try:
+        first_day = date.fromisoformat(request.args.get("start", ""))
+        last_day = date.fromisoformat(request.args.get("end", ""))
+    except ValueError:
+        return jsonify({"error": "start and end must be YYYY-MM-DD dates"}), 400
+    if last_day < first_day or (last_day - first_day).days >= AVAILABILITY_RANGE_MAX_DAYS:
+        return jsonify({"error": f"range must cover 1-{AVAILABILITY_RANGE_MAX_DAYS} days"}), 400
+    employee_id = request.args.get("employee_id")
+    service_id = request.args.get("service_id", type=int)
+    include_slots = request.args.get("include_slots") in {"1", "true"}
+    conn = get_db()
+    length = SLOT_LENGTH
+    if service_id:
+        service = conn.execute("SELECT * FROM services WHERE id=?", (service_id,)).fetchone()
+        length = service_footprint(service)
+    employees = conn.execute("SELECT id FROM users WHERE role IN ('employee','admin')").fetchall()
+    employee_ids = [
+        emp["id"] for emp in employees if not employee_id or employee_id == "any" or int(employee_id) == emp["id"]
+    ]
+    by_employee = available_slots_for_range(conn, employee_ids, first_day, last_day, length)
+    days = {}
+    day = first_day
+    while day <= last_day:
+        entry = {
+            "open": sum(len(by_employee[emp_id][day]) for emp_id in employee_ids),
+            "by_employee": {str(emp_id): len(by_employee[emp_id][day]) for emp_id in employee_ids},
+        }
+        if include_slots:
+            entry["slots"] = {
+                str(emp_id): [s.strftime("%H:%M") for s in by_employee[emp_id][day]] for emp_id in employee_ids
+            }
+        days[day.isoformat()] = entry
+        day += timedelta(days=1)
+    return jsonify({"start": first_day.isoformat(), "end": last_day.isoformat(), "days": days})
+
+
+@app.route("/api/next-available")
+def api_next_available():
+    employee_id = request.args.get("employee_id")
+    service_id = request.args.get("service_id", type=int)
+    limit = min(max(request.args.get("limit", 5, type=int), 1), 20)
+    horizon_days = min(max(request.args.get("days", 90, type=int), 1), 180)
+    conn = get_db()
+    length = SLOT_LENGTH
+    if service_id:
+        service = conn.execute("SELECT * FROM services WHERE id=?", (service_id,)).fetchone()
+        length = service_footprint(service)
+    employees = conn.execute("SELECT id, name FROM users WHERE role IN ('employee','admin')").fetchall()
+    names = {
+        emp["id"]: emp["name"]
+        for emp in employees
+        if not employee_id or employee_id == "any" or int(employee_id) == emp["id"]
+    }
+    slots = next_available_slots(conn, names, length, limit=limit, horizon_days=horizon_days)
+    return jsonify(
+        [
+            {
+                "employee_id": emp_id,
+                "employee_name": names[emp_id],
+                "date": slot.date().isoformat(),
+                "value": slot.strftime("%H:%M"),
+                "label": slot.strftime("%a %b %d, %I:%M %p"),
+            }
+            for slot, emp_id in slots
+        ]
+    )
+
+
+@app.route("/stripe/webhook", methods=["POST"])
+def stripe_webhook():
+    """Queue a verified Stripe event; process_stripe_events applies it outside the request."""
+    secret = os.environ.get("STRIPE_WEBHOOK_SECRET")
+    payload = request.get_data()
+    if not secret or not verify_stripe_signature(payload, request.headers.get("Stripe-Signature"), secret):
+        return jsonify({"error": "invalid signature"}), 400
+    try:
+        event = json.loads(payload)
+        event_id, event_type = event["id"], event["type"]
+    except (ValueError, KeyError, TypeError):
+        return jsonify({"error": "malformed event"}), 400
+    conn = get_db()
+    # Stripe redelivers events; the primary key drops the duplicates.
+    conn.execute(
+        "INSERT OR IGNORE INTO stripe_events (id, type, payload) VALUES (?, ?, ?)",
+        (event_id, event_type, payload.decode()),
+    )
+    conn.commit()
+    notify_stripe_events()
+    return jsonify({"received": True})
+
+
 @app.context_processor
 def inject_user():
     return {
@@ -1340,8 +4033,24 @@ def inject_user():
     }
 
 
-init_db()
+def create_app(config=None):
+    """Return the configured studio app, with its schema checked.
+
+    Routes are registered on the module-level ``app`` at import, so this is
+    one app per process: ``config`` overrides its settings (``DATABASE``,
+    ``SECRET_KEY``, ``UPLOAD_FOLDER``, ``AUTO_MIGRATE``, ``SQL_SLOW_QUERY_MS``,
+    ``METRICS_TOKEN``, ``PROFILE_*``, ``ANY_ARTIST_POLICY``, ...) before the
+    schema check. Their defaults come from the environment variables of the
+    same name. Importing ``app`` directly also works; the check then runs
+    on the first database connection.
+    """
+    if config:
+        app.config.update(config)
+        _schema_ready.clear()
+    ensure_schema()
+    start_reminder_thread()
+    return app
 
 
 if __name__ == "__main__":
-    app.run(debug=True)
+    create_app().run(debug=True)
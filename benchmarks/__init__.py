@@ -0,0 +1,5 @@
+"""Benchmarks and load tests for the booking hot paths.
+
+Scripts in this package create their own scratch database (``KIMQ_DATABASE``)
+and never touch ``kimq.db``. See README.md for the entry points.
+"""
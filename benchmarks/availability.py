@@ -0,0 +1,120 @@
+"""Compare the per-slot availability probes with the set-based and bitmap engines.
+
+Run with ``python benchmarks/availability.py [--days N] [--seed S]``. A scratch
+database is created in a temp directory so ``kimq.db`` is never touched.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def legacy_slots(app_module, conn, employee_id, day, length):
+    weekday = day.weekday()
+    avail_blocks = conn.execute(
+        "SELECT * FROM availability WHERE employee_id=? AND weekday=?",
+        (employee_id, weekday),
+    ).fetchall()
+    slots = []
+    for block in avail_blocks:
+        start_t = datetime.combine(day, datetime.strptime(block["start_time"], "%H:%M").time())
+        end_t = datetime.combine(day, datetime.strptime(block["end_time"], "%H:%M").time())
+        cursor = start_t
+        while cursor + length <= end_t:
+            if not app_module.slot_taken(conn, employee_id, cursor, length) and not app_module.within_time_off(
+                conn, employee_id, cursor, length
+            ):
+                slots.append(cursor)
+            cursor += timedelta(minutes=30)
+    return slots
+
+
+def seed_bookings(conn, employees, start_day, days, rng):
+    for offset in range(days):
+        day = start_day + timedelta(days=offset)
+        for emp_id in employees:
+            for _ in range(rng.randint(0, 6)):
+                start = datetime.combine(day, datetime.min.time()) + timedelta(minutes=rng.randrange(8 * 60, 20 * 60, 15))
+                end = start + timedelta(minutes=rng.choice([60, 90, 120, 165]))
+                conn.execute(
+                    "INSERT INTO appointments (employee_id, service_id, start_time, end_time, status) VALUES (?, 1, ?, ?, 'Booked')",
+                    (emp_id, start.isoformat(), end.isoformat()),
+                )
+            if rng.random() < 0.15:
+                start = datetime.combine(day, datetime.min.time()) + timedelta(hours=rng.randint(8, 16))
+                end = start + timedelta(hours=rng.randint(1, 4))
+                blocks = [(start, end)]
+                if rng.random() < 0.5:
+                    # An adjacent or overlapping second block: only one that covers a slot on its own blocks it.
+                    follow = end - timedelta(minutes=rng.choice([0, 0, 30, 60]))
+                    blocks.append((follow, follow + timedelta(minutes=rng.choice([60, 75, 120]))))
+                conn.executemany(
+                    "INSERT INTO time_off (employee_id, start_time, end_time, reason) VALUES (?, ?, ?, 'bench')",
+                    [(emp_id, block_start.isoformat(), block_end.isoformat()) for block_start, block_end in blocks],
+                )
+    conn.commit()
+
+
+def measure(conn, fn):
+    queries = []
+    conn.set_trace_callback(queries.append)
+    started = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - started
+    conn.set_trace_callback(None)
+    return result, len(queries), elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp(prefix="kimq-bench-")
+    os.environ["KIMQ_DATABASE"] = os.path.join(tmpdir, "bench.db")
+    sys.path.insert(0, ROOT)
+    import app as app_module
+
+    conn = app_module.get_db()
+    employees = [row["id"] for row in conn.execute("SELECT id FROM users WHERE role IN ('employee','admin')")]
+    start_day = date.today()
+    seed_bookings(conn, employees, start_day, args.days, random.Random(args.seed))
+    app_module.rebuild_occupancy(conn)
+    conn.commit()
+
+    lengths = [app_module.service_footprint(row) for row in conn.execute("SELECT * FROM services")]
+    totals = {"legacy": [0, 0.0], "engine": [0, 0.0], "bitmap": [0, 0.0]}
+    probes = 0
+    for offset in range(args.days):
+        day = start_day + timedelta(days=offset)
+        for emp_id in employees:
+            length = lengths[(offset + emp_id) % len(lengths)]
+            old, old_q, old_t = measure(conn, lambda: legacy_slots(app_module, conn, emp_id, day, length))
+            new, new_q, new_t = measure(conn, lambda: app_module.available_slots_for_employee(conn, emp_id, day, length))
+            bits, bits_q, bits_t = measure(
+                conn, lambda: app_module.available_slots_from_bitmaps(conn, [emp_id], day, length)[emp_id]
+            )
+            if old != new or old != bits:
+                raise SystemExit(f"slot mismatch for employee {emp_id} on {day} ({length}): {old} != {new} / {bits}")
+            totals["legacy"][0] += old_q
+            totals["legacy"][1] += old_t
+            totals["engine"][0] += new_q
+            totals["engine"][1] += new_t
+            totals["bitmap"][0] += bits_q
+            totals["bitmap"][1] += bits_t
+            probes += 1
+    conn.close()
+
+    print(f"{probes} employee-days, identical slots")
+    for name, (queries, elapsed) in totals.items():
+        print(f"{name:>7}: {queries / probes:6.1f} queries/employee-day  {elapsed / probes * 1000:7.3f} ms/employee-day")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""Hammer a single slot from many threads and check exactly one booking wins.
+
+Each round fires ``--threads`` concurrent POST /book requests (each thread has
+its own test client, hence its own SQLite connection) for the same artist and
+start time, with a slow simulated payment call to widen the race window. Run
+with ``python benchmarks/booking_race.py [--threads N] [--rounds R]``.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--payment-delay", type=float, default=0.05, help="seconds the fake payment call sleeps")
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp(prefix="kimq-race-")
+    os.environ["KIMQ_DATABASE"] = os.path.join(tmpdir, "race.db")
+    os.environ["EMAIL_OUTBOX_WORKER"] = "external"
+    sys.path.insert(0, ROOT)
+    import app as app_module
+
+    def slow_payment(amount_cents, description, customer_email=None, idempotency_key=None):
+        time.sleep(args.payment_delay)
+        # Like Stripe: one intent per idempotency key, a new one per submission.
+        return f"pi_race_{idempotency_key}", "simulated"
+
+    app_module.create_payment_intent = slow_payment
+    conn = app_module.get_db()
+    employee_id = conn.execute("SELECT employee_id FROM availability WHERE weekday=0 LIMIT 1").fetchone()[0]
+    service_id = conn.execute("SELECT id FROM services ORDER BY id LIMIT 1").fetchone()[0]
+    monday = date.today() + timedelta(days=7 - date.today().weekday())
+
+    failures = 0
+    for round_no in range(args.rounds):
+        day = monday + timedelta(weeks=round_no)
+        barrier = threading.Barrier(args.threads)
+        outcomes = []
+
+        def attempt(n):
+            client = app_module.app.test_client()
+            barrier.wait()
+            resp = client.post(
+                "/book",
+                data={
+                    "service_id": service_id,
+                    "employee_id": employee_id,
+                    "date": day.isoformat(),
+                    "time": "10:00",
+                    "name": f"Racer {n}",
+                    "email": f"racer{n}@example.com",
+                    "phone": "555-0100",
+                },
+            )
+            outcomes.append("/appointment/" in resp.headers.get("Location", ""))
+
+        workers = [threading.Thread(target=attempt, args=(n,)) for n in range(args.threads)]
+        started = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - started
+        booked = conn.execute(
+            "SELECT COUNT(*) FROM appointments WHERE employee_id=? AND start_time LIKE ?",
+            (employee_id, f"{day.isoformat()}T%"),
+        ).fetchone()[0]
+        ok = sum(outcomes) == 1 and booked == 1
+        failures += not ok
+        print(f"round {round_no + 1}: {sum(outcomes)} winner(s), {booked} appointment(s), {elapsed * 1000:.0f} ms {'ok' if ok else 'FAIL'}")
+    conn.close()
+    if failures:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
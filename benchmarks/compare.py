@@ -0,0 +1,31 @@
+"""Diff two JSON reports from ``benchmarks.routes``.
+
+Usage: ``python -m benchmarks.compare before.json after.json``
+"""
+import json
+import sys
+
+METRICS = ("p50_ms", "p95_ms", "p99_ms", "rps", "success_rate", "queries_per_request", "db_ms_per_request")
+
+
+def main():
+    if len(sys.argv) != 3:
+        raise SystemExit(__doc__)
+    with open(sys.argv[1], encoding="utf-8") as f:
+        before = json.load(f)
+    with open(sys.argv[2], encoding="utf-8") as f:
+        after = json.load(f)
+    print(f"{before.get('revision')} -> {after.get('revision')}")
+    for scenario, stats in after["results"].items():
+        old = before["results"].get(scenario, {})
+        cells = []
+        for metric in METRICS:
+            if stats.get(metric) is None or old.get(metric) is None:
+                continue
+            change = (stats[metric] - old[metric]) / old[metric] * 100 if old[metric] else 0.0
+            cells.append(f"{metric} {old[metric]} -> {stats[metric]} ({change:+.1f}%)")
+        print(f"{scenario:>12}: " + "  ".join(cells))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,337 @@
+"""Exercise the integrations layer against a local stub of every provider.
+
+Usage: ``python benchmarks/integrations_stub.py``
+
+Points STRIPE/RESEND/EZTEXTING/INSTAGRAM ``*_API_BASE`` at an in-process HTTP
+server, then checks keep-alive reuse, retries on transient failures, that a
+non-idempotent SMS is never resent after a 500, the circuit breaker opening and
+recovering, the outbox draining email and SMS through it, and the reminder job
+batching, rate-limiting and not repeating itself. The Stripe stub honours
+Idempotency-Key, and signed webhook events are posted to ``/stripe/webhook`` to
+check that a double-submitted booking charges once and that queued events
+reconcile payments, appointments and gift cards. Exits non-zero on the first
+failed check.
+"""
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class StubState:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.hits = {}
+        self.connections = set()
+        # path -> list of status codes to return before succeeding
+        self.failures = {}
+        # Idempotency-Key -> PaymentIntent id, as Stripe replays keyed requests
+        self.intents = {}
+        # path -> seconds to wait before answering
+        self.delays = {}
+
+    def next_status(self, path):
+        with self.lock:
+            self.hits[path] = self.hits.get(path, 0) + 1
+            queued = self.failures.get(path)
+            return queued.pop(0) if queued else 200
+
+
+STATE = StubState()
+RESPONSES = {
+    "/emails": {"id": "email_stub"},
+    "/emails/batch": {"data": [{"id": "email_stub"}]},
+    "/v1/messages": {"id": "sms_stub"},
+    "/me/media": {
+        "data": [{"id": str(n), "media_url": f"https://example.com/{n}.jpg", "caption": f"post {n}"} for n in range(3)]
+    },
+}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def respond(self):
+        path = self.path.split("?", 1)[0]
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            self.rfile.read(length)
+        STATE.connections.add(self.client_address)
+        status = STATE.next_status(path)
+        time.sleep(STATE.delays.get(path, 0))
+        payload = RESPONSES.get(path, {}) if status == 200 else {"error": "stub failure"}
+        if path == "/v1/payment_intents" and status == 200:
+            with STATE.lock:
+                key = self.headers.get("Idempotency-Key") or f"unkeyed-{STATE.hits[path]}"
+                intent_id = STATE.intents.setdefault(key, f"pi_stub_{len(STATE.intents) + 1}")
+            payload = {"id": intent_id, "object": "payment_intent", "status": "requires_payment_method"}
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = respond
+    do_POST = respond
+
+
+def check(label, condition, detail=""):
+    print(f"{'ok  ' if condition else 'FAIL'} {label}{': ' + detail if detail else ''}")
+    if not condition:
+        raise SystemExit(1)
+
+
+def main():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    tmpdir = tempfile.mkdtemp(prefix="kimq-stub-")
+    os.environ.update(
+        {
+            "KIMQ_DATABASE": os.path.join(tmpdir, "stub.db"),
+            "EMAIL_OUTBOX_WORKER": "external",
+            "STRIPE_API_BASE": base,
+            "RESEND_API_BASE": base,
+            "EZTEXTING_API_BASE": base + "/v1",
+            "INSTAGRAM_API_BASE": base,
+            "STRIPE_TEST_KEY": "sk_test_stub",
+            "RESEND_API_KEY": "re_stub",
+            "EZTEXTING_API_KEY": "ez_stub",
+            "INSTAGRAM_ACCESS_TOKEN": "ig_stub",
+            "RESEND_RATE_PER_SECOND": "200",
+            "EZTEXTING_RATE_PER_SECOND": "50",
+            "STRIPE_WEBHOOK_SECRET": "whsec_stub",
+            "STRIPE_EVENTS_WORKER": "external",
+        }
+    )
+    os.environ.pop("STRIPE_SECRET_KEY", None)
+    sys.path.insert(0, ROOT)
+    import app as app_module
+    import integrations
+
+    for _ in range(5):
+        app_module.send_email("guest@example.com", "Hello", "<p>Hi</p>")
+    check("5 emails reuse one pooled connection", len(STATE.connections) == 1, f"{len(STATE.connections)} connection(s)")
+
+    STATE.failures["/emails"] = [503, 502]
+    app_module.send_email("guest@example.com", "Retry", "<p>Hi</p>", idempotency_key="outbox-1")
+    check("idempotent email retried through 503/502", STATE.hits["/emails"] == 8, f"{STATE.hits['/emails']} hits")
+
+    STATE.failures["/v1/messages"] = [500]
+    try:
+        app_module.send_sms("(313) 555-0100", "hi")
+        raised = False
+    except integrations.IntegrationError:
+        raised = True
+    check("SMS is not resent after a 500", raised and STATE.hits["/v1/messages"] == 1)
+
+    sms = integrations.provider("eztexting")
+    sms.breaker.reset_seconds = 0.3
+    sms.breaker.record_success()
+    STATE.failures["/v1/messages"] = [500] * sms.breaker.threshold
+    for _ in range(sms.breaker.threshold):
+        try:
+            app_module.send_sms("3135550100", "hi")
+        except integrations.IntegrationError:
+            pass
+    hits_before = STATE.hits["/v1/messages"]
+    try:
+        app_module.send_sms("3135550100", "hi")
+        opened = False
+    except integrations.CircuitOpenError:
+        opened = True
+    check("breaker opens after repeated failures", opened and STATE.hits["/v1/messages"] == hits_before, sms.breaker.state)
+    time.sleep(0.35)
+    app_module.send_sms("3135550100", "hi")
+    check("breaker closes after a successful probe", sms.breaker.state == "closed")
+
+    posts = app_module.fetch_instagram_posts(limit=3)
+    check("instagram feed parsed", len(posts) == 3)
+
+    intent_id, status = app_module.create_payment_intent(5000, "Stub deposit", "guest@example.com")
+    check("stripe intent through the pooled client", intent_id.startswith("pi_stub") and status == "requires_payment_method")
+    keyed = [app_module.create_payment_intent(5000, "Stub deposit", idempotency_key="kimq-payment-1")[0] for _ in range(2)]
+    check("same idempotency key, same intent", keyed[0] == keyed[1])
+
+    conn = app_module.connect_db()
+    app_module.queue_email(conn, "guest@example.com", "Queued", "<p>Hi</p>")
+    app_module.queue_sms(conn, "3135550100", "Queued text")
+    conn.commit()
+    conn.close()
+    emails, texts = STATE.hits["/emails"], STATE.hits["/v1/messages"]
+    app_module.drain_outbox()
+    conn = app_module.connect_db()
+    statuses = [row[0] for row in conn.execute("SELECT status FROM email_outbox ORDER BY id")]
+    conn.close()
+    check(
+        "outbox drained email and SMS",
+        statuses == ["sent", "sent"] and STATE.hits["/emails"] == emails + 1 and STATE.hits["/v1/messages"] == texts + 1,
+    )
+
+    conn = app_module.connect_db()
+    now = datetime.now().replace(microsecond=0)
+    for n in range(150):
+        client_id = conn.execute(
+            "INSERT INTO clients (name, email, phone) VALUES (?, ?, ?)",
+            (f"Guest {n}", f"guest{n}@example.com", f"313555{n:04d}" if n < 20 else None),
+        ).lastrowid
+        start_at = now + timedelta(minutes=30 + n * 9)
+        conn.execute(
+            "INSERT INTO appointments (client_id, service_id, employee_id, start_time, end_time, status) "
+            "VALUES (?, 1, 2, ?, ?, 'Booked')",
+            (client_id, app_module.to_db_time(start_at), app_module.to_db_time(start_at + timedelta(hours=1))),
+        )
+    conn.commit()
+    conn.close()
+    batches, texts = STATE.hits.get("/emails/batch", 0), STATE.hits["/v1/messages"]
+    started = time.perf_counter()
+    counts = app_module.send_reminders(now=now)
+    elapsed = time.perf_counter() - started
+    check(
+        "reminders batched by email, texted one by one",
+        counts == {"due": 170, "claimed": 170, "sent": 170, "failed": 0}
+        and STATE.hits["/emails/batch"] == batches + 2
+        and STATE.hits["/v1/messages"] == texts + 20,
+        str(counts),
+    )
+    check("texts paced by the EZTexting rate limit", elapsed >= 19 / 50, f"{elapsed:.2f}s")
+    again = app_module.send_reminders(now=now)
+    check("rerun sends nothing twice", again["claimed"] == 0 and STATE.hits["/emails/batch"] == batches + 2, str(again))
+
+    client = app_module.app.test_client()
+    day = date.today() + timedelta(days=(7 - date.today().weekday()) % 7 or 7)
+    form = {
+        "submission_token": "stub-booking",
+        "service_id": 1,
+        "employee_id": "any",
+        "date": day.isoformat(),
+        "time": "10:00",
+        "name": "Stub Guest",
+        "email": "stub@example.com",
+        "phone": "",
+    }
+    intents_before = STATE.hits["/v1/payment_intents"]
+    first = client.post("/book", data=form)
+    second = client.post("/book", data=form)
+    conn = app_module.connect_db()
+    payments = conn.execute("SELECT * FROM payments WHERE submission_token='stub-booking'").fetchall()
+    appointments = conn.execute(
+        "SELECT * FROM appointments WHERE payment_intent_id=?", (payments[0]["payment_intent_id"],)
+    ).fetchall()
+    conn.close()
+    check(
+        "resubmitted booking form charges and books once",
+        len(payments) == 1 and len(appointments) == 1 and STATE.hits["/v1/payment_intents"] == intents_before + 1
+        and first.headers["Location"] == second.headers["Location"],
+    )
+    booking_intent = payments[0]["payment_intent_id"]
+
+    # A double click on the same form for a named artist: the second request
+    # must end on the first one's booking, not lose the slot to it.
+    conn = app_module.connect_db()
+    artist = conn.execute("SELECT employee_id FROM availability WHERE weekday=? LIMIT 1", (day.weekday(),)).fetchone()[0]
+    conn.close()
+    double = dict(form, submission_token="stub-double", employee_id=artist, time="14:00", email="double@example.com")
+    STATE.delays["/v1/payment_intents"] = 0.3
+    locations = []
+
+    def submit():
+        racer_client = app_module.app.test_client()
+        location = racer_client.post("/book", data=double).headers.get("Location", "")
+        while "/book/submitted/" in location:
+            # The "booking in progress" page, reloaded the way its Refresh header asks.
+            time.sleep(0.1)
+            pending = racer_client.get(location)
+            location = pending.headers.get("Location", location if pending.status_code == 200 else "")
+        locations.append(location)
+
+    racers = [threading.Thread(target=submit) for _ in range(2)]
+    for racer in racers:
+        racer.start()
+        time.sleep(0.05)
+    for racer in racers:
+        racer.join()
+    STATE.delays.clear()
+    conn = app_module.connect_db()
+    doubles = conn.execute(
+        "SELECT a.id FROM appointments a JOIN payments p ON p.payment_intent_id = a.payment_intent_id "
+        "WHERE p.submission_token='stub-double'"
+    ).fetchall()
+    conn.close()
+    check(
+        "double-submitted form for one artist books once, both land on it",
+        len(doubles) == 1 and len(set(locations)) == 1 and "/appointment/" in locations[0],
+        str(locations),
+    )
+    client.post("/gift-cards", data={"submission_token": "stub-gift", "to_name": "A", "from_name": "B",
+                                     "email": "gift@example.com", "amount": "100", "message": "hi"})
+    client.post("/gift-cards", data={"submission_token": "stub-gift", "to_name": "A", "from_name": "B",
+                                     "email": "gift@example.com", "amount": "100", "message": "hi"})
+    conn = app_module.connect_db()
+    gift_cards = conn.execute(
+        "SELECT g.* FROM gift_cards g JOIN payments p ON p.payment_intent_id = g.payment_intent_id "
+        "WHERE p.submission_token='stub-gift'"
+    ).fetchall()
+    conn.close()
+    check("resubmitted gift card form buys one card", len(gift_cards) == 1)
+    gift_intent = gift_cards[0]["payment_intent_id"]
+
+    def post_event(event_id, event_type, obj, created, secret="whsec_stub"):
+        body = json.dumps({"id": event_id, "type": event_type, "created": created, "data": {"object": obj}}).encode()
+        return client.post(
+            "/stripe/webhook",
+            data=body,
+            headers={"Stripe-Signature": app_module.stripe_signature(body, secret), "Content-Type": "application/json"},
+        )
+
+    now_ts = int(time.time())
+    forged = post_event("evt_forged", "payment_intent.succeeded", {"id": booking_intent, "status": "succeeded"},
+                        now_ts, secret="whsec_wrong")
+    check("unsigned webhook rejected", forged.status_code == 400)
+    post_event("evt_1", "payment_intent.succeeded", {"id": booking_intent, "status": "succeeded"}, now_ts)
+    post_event("evt_1", "payment_intent.succeeded", {"id": booking_intent, "status": "succeeded"}, now_ts)
+    post_event("evt_2", "payment_intent.payment_failed",
+               {"id": booking_intent, "status": "requires_payment_method"}, now_ts - 60)
+    post_event("evt_3", "charge.refunded", {"id": "ch_1", "payment_intent": gift_intent}, now_ts)
+    post_event("evt_4", "payment_intent.succeeded", {"id": "pi_elsewhere", "status": "succeeded"}, now_ts)
+    post_event("evt_5", "customer.created", {"id": "cus_1"}, now_ts)
+    processed = app_module.process_stripe_events()
+    conn = app_module.connect_db()
+    payment = conn.execute("SELECT status FROM payments WHERE payment_intent_id=?", (booking_intent,)).fetchone()
+    appointment = conn.execute(
+        "SELECT payment_status FROM appointments WHERE payment_intent_id=?", (booking_intent,)
+    ).fetchone()
+    gift = conn.execute("SELECT status FROM gift_cards WHERE payment_intent_id=?", (gift_intent,)).fetchone()
+    events = dict(conn.execute("SELECT id, status FROM stripe_events"))
+    conn.close()
+    check(
+        "webhook events reconciled in one batch",
+        processed == 5 and payment["status"] == "succeeded" and appointment["payment_status"] == "succeeded"
+        and gift["status"] == "Refunded",
+        f"{processed} event(s), payment {payment['status']}, gift card {gift['status']}",
+    )
+    check(
+        "unknown intents wait for their booking, other types ignored",
+        events == {"evt_1": "processed", "evt_2": "processed", "evt_3": "processed", "evt_4": "pending",
+                   "evt_5": "ignored"},
+        str(events),
+    )
+
+    for name, stats in integrations.stats().items():
+        print(f"{name:>10}: {stats['calls']} call(s), {stats['errors']} error(s), {stats['retries']} retr(y/ies), "
+              f"{stats['seconds'] * 1000:.1f} ms, breaker {stats['breaker']}")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""EXPLAIN QUERY PLAN regression check for the hot queries.
+
+Drives the booking, availability, billing, dashboard, client, client search and
+admin routes (including a second page of every admin list) through Flask's test
+client against a scratch database, then claims the booking's reminders. It
+captures every SELECT they issue and fails if any of them scans a large table,
+or sorts a whole table just to return a LIMITed page. Run with ``python benchmarks/query_plans.py``.
+"""
+import os
+import sys
+import tempfile
+from datetime import date, datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Tables that grow with bookings; a plain SCAN over any of these is a regression.
+HOT_TABLES = {
+    "appointments", "time_off", "payments", "clients", "client_notes", "client_photos", "gift_cards",
+    "appointment_reminders",
+}
+# Whole-table aggregates that are expected to scan, the admin top-paths
+# query, which only sorts a single day's access_log_hits rows, and client
+# search, which re-sorts its already LIMITed FTS matches after the join.
+ALLOWED = ("SUM(amount_cents)", "FROM access_log_hits WHERE day=", "FROM client_search WHERE client_search MATCH")
+
+
+def plan_problems(conn, sql):
+    problems = []
+    for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}"):
+        detail = row[3]
+        words = detail.split()
+        if words[:1] == ["SCAN"] and words[1] in HOT_TABLES and "USING" not in words:
+            problems.append(detail)
+        if "TEMP B-TREE" in detail and " LIMIT " in sql.upper():
+            problems.append(detail)
+    return problems
+
+
+def main():
+    tmpdir = tempfile.mkdtemp(prefix="kimq-plans-")
+    os.environ["KIMQ_DATABASE"] = os.path.join(tmpdir, "plans.db")
+    sys.path.insert(0, ROOT)
+    import app as app_module
+
+    captured = []
+    original_get_db = app_module.get_db
+
+    def tracing_get_db():
+        conn = original_get_db()
+        conn.set_trace_callback(captured.append)
+        return conn
+
+    app_module.get_db = tracing_get_db
+    client = app_module.app.test_client()
+    day = date.today() + timedelta(days=(7 - date.today().weekday()) % 7 or 7)
+    client.post(
+        "/book",
+        data={
+            "service_id": 1,
+            "employee_id": "any",
+            "date": day.isoformat(),
+            "time": "10:00",
+            "name": "Plan Check",
+            "email": "plans@example.com",
+            "phone": "555-0100",
+        },
+    )
+    with client.session_transaction() as sess:
+        sess["user_id"] = 1
+    for url in [
+        f"/api/availability?date={day.isoformat()}&service_id=1",
+        "/book",
+        "/billing",
+        "/dashboard",
+        "/clients/1",
+        "/api/clients/search?q=plan",
+        "/admin",
+    ]:
+        client.get(url)
+    for name in app_module.ADMIN_LISTS:
+        first = client.get(f"/api/admin/{name}?limit=1").get_json()
+        if first["next_cursor"]:
+            client.get(f"/api/admin/{name}?limit=1&after={first['next_cursor']}")
+    app_module.get_db = original_get_db
+
+    conn = original_get_db()
+    conn.set_trace_callback(captured.append)
+    app_module.claim_reminders(conn, app_module.due_reminders(conn, datetime.combine(day, datetime.min.time())))
+    conn.set_trace_callback(None)
+    failures = 0
+    seen = set()
+    for sql in captured:
+        statement = sql.strip()
+        if not statement.upper().startswith("SELECT") or statement in seen:
+            continue
+        seen.add(statement)
+        if any(marker in statement for marker in ALLOWED):
+            continue
+        problems = plan_problems(conn, statement)
+        if problems:
+            failures += 1
+            print(f"FAIL {' '.join(statement.split())[:160]}")
+            for detail in problems:
+                print(f"     {detail}")
+    conn.close()
+    print(f"checked {len(seen)} distinct queries, {failures} without index support")
+    if failures:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
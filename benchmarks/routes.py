@@ -0,0 +1,308 @@
+"""Latency, throughput and SQL query counts for the booking hot paths.
+
+Usage::
+
+    python -m benchmarks.routes --employees 8 --appointments 100000 --requests 200 --output before.json
+    python -m benchmarks.routes --server --processes 4 --concurrency 8
+
+By default requests go through Flask's test client in-process, which also
+reports SQL statements per request. ``--server`` serves the app from a
+multi-process local WSGI server and drives it over HTTP with concurrent
+clients; query counts are not available in that mode. The JSON written to
+``--output`` can be compared with ``python -m benchmarks.compare``.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCENARIOS = ("availability", "book", "home", "services", "admin")
+ADMIN_EMAIL = "quraishi1125@gmail.com"
+ADMIN_PASSWORD = "adminpass"
+BOOK_CANDIDATES = 20
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def succeeded(scenario, status_code, location):
+    """A booking only counts when it redirects to the new appointment's page."""
+    if scenario == "book":
+        return 300 <= status_code < 400 and "/appointment/" in (location or "")
+    return status_code == 200
+
+
+def summarize(latencies, elapsed, errors, successes, queries=None):
+    ordered = sorted(latencies)
+    summary = {
+        "requests": len(latencies),
+        "errors": errors,
+        "success_rate": round(successes / len(latencies), 3) if latencies else None,
+        "rps": round(len(latencies) / elapsed, 1) if elapsed else None,
+        "p50_ms": round(percentile(ordered, 50) * 1000, 3) if ordered else None,
+        "p95_ms": round(percentile(ordered, 95) * 1000, 3) if ordered else None,
+        "p99_ms": round(percentile(ordered, 99) * 1000, 3) if ordered else None,
+    }
+    if queries is not None:
+        summary["queries_per_request"] = round(sum(queries) / len(queries), 2) if queries else None
+        summary["max_queries"] = max(queries) if queries else None
+    return summary
+
+
+class RequestFactory:
+    """Builds the next request for a scenario with deterministic randomness.
+
+    Book requests target a slot ``next_available_slots`` reports as open and
+    that no earlier request from this factory has been sent for, so ``/book``
+    measures an actual booking rather than the "no availability" redirect.
+    """
+
+    def __init__(self, app_module, service_ids, seed_value):
+        self.app_module = app_module
+        self.service_ids = service_ids
+        self.rng = random.Random(seed_value)
+        self.lock = threading.Lock()
+        self.claimed = {}
+
+    def workday(self):
+        day = date.today() + timedelta(days=self.rng.randint(1, 60))
+        while day.weekday() >= 5:
+            day += timedelta(days=1)
+        return day
+
+    def free_slot(self, service_id):
+        conn = self.app_module.connect_db()
+        try:
+            service = conn.execute("SELECT * FROM services WHERE id=?", (service_id,)).fetchone()
+            employee_ids = [row[0] for row in conn.execute("SELECT id FROM users WHERE role IN ('employee','admin')")]
+            length = self.app_module.service_footprint(service)
+            after = datetime.combine(self.workday(), datetime.min.time())
+            slots = self.app_module.next_available_slots(conn, employee_ids, length, after=after, limit=BOOK_CANDIDATES)
+        finally:
+            conn.close()
+        # Requests still in flight (server mode) have not committed yet, so
+        # skip anything overlapping a slot already handed out.
+        for start, employee_id in slots:
+            end = start + length
+            taken = self.claimed.setdefault(employee_id, [])
+            if all(end <= other_start or other_end <= start for other_start, other_end in taken):
+                taken.append((start, end))
+                return start, employee_id
+        return None, None
+
+    def build(self, scenario):
+        with self.lock:
+            if scenario == "availability":
+                return "GET", f"/api/availability?date={self.workday().isoformat()}&service_id={self.rng.choice(self.service_ids)}", None
+            if scenario == "book":
+                n = self.rng.randrange(10**9)
+                # Long services can be fully booked on a dense seed; fall through to others.
+                for service_id in self.rng.sample(self.service_ids, len(self.service_ids)):
+                    slot, employee_id = self.free_slot(service_id)
+                    if slot:
+                        break
+                else:
+                    slot = datetime.combine(self.workday(), datetime.min.time()).replace(hour=9)
+                return "POST", "/book", {
+                    "service_id": service_id,
+                    "employee_id": employee_id or "any",
+                    "date": slot.date().isoformat(),
+                    "time": slot.strftime("%H:%M"),
+                    "name": f"Bench {n}",
+                    "email": f"bench{n}@bench.test",
+                    "phone": "555-0100",
+                }
+            if scenario == "home":
+                return "GET", "/", None
+            if scenario == "services":
+                return "GET", "/services", None
+            return "GET", "/admin", None
+
+
+def run_test_client(app_module, factory, scenarios, count, warmup):
+    connections = []
+    original_connect = app_module.connect_db
+
+    def recording_connect(*args, **kwargs):
+        conn = original_connect(*args, **kwargs)
+        connections.append(conn)
+        return conn
+
+    app_module.connect_db = recording_connect
+    with app_module.app.app_context():
+        admin_id = app_module.get_db().execute("SELECT id FROM users WHERE role='admin' ORDER BY id LIMIT 1").fetchone()[0]
+    results = {}
+    try:
+        for scenario in scenarios:
+            client = app_module.app.test_client()
+            if scenario == "admin":
+                with client.session_transaction() as sess:
+                    sess["user_id"] = admin_id
+            latencies, per_request, db_seconds, errors, successes = [], [], [], 0, 0
+            for i in range(warmup + count):
+                method, url, data = factory.build(scenario)
+                connections.clear()
+                started = time.perf_counter()
+                resp = client.open(url, method=method, data=data)
+                took = time.perf_counter() - started
+                if i < warmup:
+                    continue
+                latencies.append(took)
+                per_request.append(sum(getattr(conn, "query_count", 0) for conn in connections))
+                db_seconds.append(sum(getattr(conn, "query_seconds", 0.0) for conn in connections))
+                errors += resp.status_code >= 500
+                successes += succeeded(scenario, resp.status_code, resp.headers.get("Location"))
+            results[scenario] = summarize(latencies, sum(latencies), errors, successes, per_request)
+            results[scenario]["db_ms_per_request"] = round(sum(db_seconds) / len(db_seconds) * 1000, 3) if db_seconds else None
+    finally:
+        app_module.connect_db = original_connect
+    return results
+
+
+def serve(port, processes):
+    import logging
+
+    import app as app_module
+
+    from werkzeug.serving import run_simple
+
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    run_simple("127.0.0.1", port, app_module.app, processes=processes, threaded=False, use_reloader=False)
+
+
+def run_server(factory, scenarios, count, warmup, processes, concurrency):
+    import requests
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    server = multiprocessing.get_context("fork").Process(target=serve, args=(port, processes), daemon=True)
+    server.start()
+    base = f"http://127.0.0.1:{port}"
+    for _ in range(100):
+        try:
+            requests.get(f"{base}/services", timeout=1)
+            break
+        except requests.ConnectionError:
+            time.sleep(0.1)
+    local = threading.local()
+
+    def session():
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+            local.session.post(f"{base}/login", data={"email": ADMIN_EMAIL, "password": ADMIN_PASSWORD}, allow_redirects=False)
+        return local.session
+
+    def one(scenario):
+        method, url, data = factory.build(scenario)
+        started = time.perf_counter()
+        resp = session().request(method, base + url, data=data, allow_redirects=False, timeout=30)
+        took = time.perf_counter() - started
+        return took, resp.status_code >= 500, succeeded(scenario, resp.status_code, resp.headers.get("Location"))
+
+    results = {}
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            for scenario in scenarios:
+                list(pool.map(one, [scenario] * warmup))
+                started = time.perf_counter()
+                outcomes = list(pool.map(one, [scenario] * count))
+                elapsed = time.perf_counter() - started
+                results[scenario] = summarize(
+                    [o[0] for o in outcomes], elapsed, sum(o[1] for o in outcomes), sum(o[2] for o in outcomes)
+                )
+    finally:
+        server.terminate()
+        server.join()
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--employees", type=int, default=5)
+    parser.add_argument("--clients", type=int, default=5000)
+    parser.add_argument("--appointments", type=int, default=20000)
+    parser.add_argument("--seed", type=int, default=1125)
+    parser.add_argument("--requests", type=int, default=200, help="measured requests per scenario")
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--server", action="store_true", help="drive a multi-process local WSGI server over HTTP")
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--output", help="write JSON results here (default: stdout)")
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp(prefix="kimq-routes-")
+    os.environ["KIMQ_DATABASE"] = os.path.join(tmpdir, "routes.db")
+    os.environ["EMAIL_OUTBOX_WORKER"] = "external"
+    sys.path.insert(0, ROOT)
+    import app as app_module
+
+    conn = app_module.connect_db()
+    started = time.perf_counter()
+    counts = app_module.seed_scale(
+        conn,
+        employees=args.employees,
+        clients=args.clients,
+        appointments=args.appointments,
+        gift_cards=args.clients // 10,
+        notes=args.clients * 2,
+        time_off=args.employees * 20,
+        seed=args.seed,
+    )
+    seed_seconds = time.perf_counter() - started
+    service_ids = [row[0] for row in conn.execute("SELECT id FROM services")]
+    conn.close()
+
+    factory = RequestFactory(app_module, service_ids, args.seed)
+    scenarios = [name for name in args.scenarios.split(",") if name in SCENARIOS]
+    if args.server:
+        results = run_server(factory, scenarios, args.requests, args.warmup, args.processes, args.concurrency)
+    else:
+        results = run_test_client(app_module, factory, scenarios, args.requests, args.warmup)
+
+    report = {
+        "revision": git_revision(),
+        "mode": "server" if args.server else "test_client",
+        "scale": counts,
+        "seed_seconds": round(seed_seconds, 2),
+        "results": results,
+    }
+    for name, stats in results.items():
+        queries = f"  {stats['queries_per_request']:>6} q/req" if "queries_per_request" in stats else ""
+        print(
+            f"{name:>12}: p50 {stats['p50_ms']:>8} ms  p95 {stats['p95_ms']:>8} ms  p99 {stats['p99_ms']:>8} ms  "
+            f"{stats['rps']:>8} rps  {stats['success_rate']:>6.1%} ok{queries}",
+            file=sys.stderr,
+        )
+    payload = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(payload + "\n")
+    else:
+        print(payload)
+
+
+if __name__ == "__main__":
+    main()
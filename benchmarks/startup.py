@@ -0,0 +1,94 @@
+"""Cold-start cost of a worker: importing app, create_app() and the first requests.
+
+Usage::
+
+    python -m benchmarks.startup --runs 10 --path /services --output startup.json
+
+Each run is a fresh interpreter against an already-migrated scratch database,
+which is what a restarted web worker sees. ``--importtime`` also lists the
+slowest imports from ``python -X importtime``.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CHILD = """
+import json, sys, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+app.create_app()
+created = time.perf_counter()
+client = app.app.test_client()
+client.get(sys.argv[1])
+first = time.perf_counter()
+client.get(sys.argv[1])
+second = time.perf_counter()
+print(json.dumps({
+    "import_ms": (imported - started) * 1000,
+    "create_app_ms": (created - imported) * 1000,
+    "first_request_ms": (first - created) * 1000,
+    "second_request_ms": (second - first) * 1000,
+    "stripe_loaded": "stripe" in sys.modules,
+    "requests_loaded": "requests" in sys.modules,
+}))
+"""
+
+
+def run_child(path, env, extra_args=()):
+    return subprocess.run(
+        [sys.executable, *extra_args, "-c", CHILD, path], cwd=ROOT, env=env, capture_output=True, text=True, check=True
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--path", default="/services")
+    parser.add_argument("--importtime", action="store_true", help="list the slowest imports of one run")
+    parser.add_argument("--output", help="write JSON results here (default: stdout)")
+    args = parser.parse_args()
+
+    env = dict(os.environ, KIMQ_DATABASE=os.path.join(tempfile.mkdtemp(prefix="kimq-startup-"), "startup.db"))
+    env["EMAIL_OUTBOX_WORKER"] = "external"
+    run_child(args.path, env)  # migrate and seed the scratch database once
+    samples = [json.loads(run_child(args.path, env).stdout.strip().splitlines()[-1]) for _ in range(args.runs)]
+
+    phases = ("import_ms", "create_app_ms", "first_request_ms", "second_request_ms")
+    report = {
+        "path": args.path,
+        "runs": args.runs,
+        "stripe_loaded": any(sample["stripe_loaded"] for sample in samples),
+        "requests_loaded": any(sample["requests_loaded"] for sample in samples),
+    }
+    for phase in phases:
+        values = [sample[phase] for sample in samples]
+        report[phase] = {"median": round(statistics.median(values), 2), "min": round(min(values), 2)}
+        print(f"{phase:>18}: median {report[phase]['median']:>8} ms  min {report[phase]['min']:>8} ms", file=sys.stderr)
+
+    if args.importtime:
+        stderr = run_child(args.path, env, ("-X", "importtime")).stderr
+        rows = []
+        for line in stderr.splitlines():
+            if line.startswith("import time:") and "|" in line and "cumulative" not in line:
+                _, cumulative, module = (part.strip() for part in line.split(":", 1)[1].split("|"))
+                rows.append((int(cumulative), module))
+        report["slowest_imports_us"] = [{"module": module, "cumulative": cost} for cost, module in sorted(rows, reverse=True)[:15]]
+        for row in report["slowest_imports_us"]:
+            print(f"{row['cumulative']:>10} us  {row['module']}", file=sys.stderr)
+
+    payload = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(payload + "\n")
+    else:
+        print(payload)
+
+
+if __name__ == "__main__":
+    main()
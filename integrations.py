@@ -0,0 +1,273 @@
+"""Pooled, retrying HTTP clients for Stripe, Resend, EZTexting and Instagram.
+
+Each provider gets one keep-alive session, its own timeouts, bounded retries
+with full jitter and a circuit breaker. Base URLs come from
+``<PROVIDER>_API_BASE`` so the whole layer can run against a local stub server
+(see ``benchmarks/integrations_stub.py``). Nothing here imports the Flask app;
+``set_observer`` lets it record per-attempt latency.
+"""
+import os
+import random
+import threading
+import time
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# The provider turned these away without acting on them, so even a
+# non-idempotent request can be sent again.
+UNPROCESSED_STATUSES = {429, 503}
+
+_observer = None
+
+
+class IntegrationError(Exception):
+    def __init__(self, provider, message, status=None, retryable=False):
+        super().__init__(f"{provider}: {message}")
+        self.provider = provider
+        self.status = status
+        self.retryable = retryable
+
+
+class CircuitOpenError(IntegrationError):
+    def __init__(self, provider, retry_in):
+        super().__init__(provider, f"circuit open, retry in {retry_in:.0f}s", retryable=True)
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    """Opens after ``threshold`` consecutive failed calls, then lets one probe through every ``reset_seconds``."""
+
+    def __init__(self, provider, threshold=5, reset_seconds=30.0):
+        self.provider = provider
+        self.threshold = threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self.lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        return "half_open" if self.probing else "open"
+
+    def before_call(self):
+        with self.lock:
+            if self.opened_at is None:
+                return
+            waited = time.monotonic() - self.opened_at
+            if self.probing or waited < self.reset_seconds:
+                raise CircuitOpenError(self.provider, max(self.reset_seconds - waited, 0))
+            self.probing = True
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.probing or self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+            self.probing = False
+
+
+class RateLimiter:
+    """Spaces calls ``1 / rate_per_second`` apart across this process's threads."""
+
+    def __init__(self, rate_per_second):
+        self.interval = 1.0 / rate_per_second
+        self.next_at = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            now = time.monotonic()
+            wait = self.next_at - now
+            self.next_at = max(now, self.next_at) + self.interval
+        if wait > 0:
+            time.sleep(wait)
+
+
+class Provider:
+    def __init__(
+        self,
+        name,
+        base_url,
+        connect_timeout=3.05,
+        read_timeout=10.0,
+        max_attempts=3,
+        backoff_base=0.2,
+        backoff_cap=2.0,
+        pool_size=4,
+        failure_threshold=5,
+        reset_seconds=30.0,
+        rate_per_second=None,
+    ):
+        self.name = name
+        self.base_url = base_url.rstrip("/")
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.pool_size = pool_size
+        self.breaker = CircuitBreaker(name, failure_threshold, reset_seconds)
+        self.limiter = RateLimiter(rate_per_second) if rate_per_second else None
+        self.stats = {"calls": 0, "errors": 0, "retries": 0, "seconds": 0.0}
+        self._session = None
+        self._lock = threading.Lock()
+
+    def session(self):
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    import requests
+
+                    session = requests.Session()
+                    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                    session.mount("https://", adapter)
+                    session.mount("http://", adapter)
+                    self._session = session
+        return self._session
+
+    def backoff(self, attempt, retry_after=None):
+        if retry_after:
+            try:
+                return min(float(retry_after), self.backoff_cap)
+            except ValueError:
+                pass
+        return random.uniform(0, min(self.backoff_cap, self.backoff_base * 2**attempt))
+
+    def record(self, started, outcome):
+        seconds = time.perf_counter() - started
+        with self._lock:
+            self.stats["calls"] += 1
+            self.stats["errors"] += outcome != "ok"
+            self.stats["seconds"] += seconds
+        if _observer is not None:
+            _observer(self.name, seconds, outcome)
+
+    def request(self, method, path, idempotent=None, **kwargs):
+        """Send one request and return the response, retrying transient failures.
+
+        GET-like requests (or ``idempotent=True``, e.g. with an idempotency
+        key) are retried on any network error or 429/5xx. Other requests are
+        only resent when the provider provably did not process them: connect
+        timeouts, 429 and 503. Raises IntegrationError once retries run out.
+        """
+        import requests
+
+        if idempotent is None:
+            idempotent = method.upper() in ("GET", "HEAD", "PUT", "DELETE", "OPTIONS")
+        kwargs.setdefault("timeout", (self.connect_timeout, self.read_timeout))
+        self.breaker.before_call()
+        attempt = 0
+        while True:
+            attempt += 1
+            if self.limiter is not None:
+                self.limiter.acquire()
+            started = time.perf_counter()
+            retry_after = None
+            try:
+                resp = self.session().request(method, self.base_url + path, **kwargs)
+            except requests.exceptions.ConnectTimeout as exc:
+                error, retry = IntegrationError(self.name, f"connect timeout: {exc}", retryable=True), True
+            except requests.RequestException as exc:
+                error, retry = IntegrationError(self.name, str(exc), retryable=True), idempotent
+            else:
+                if resp.status_code < 400:
+                    self.record(started, "ok")
+                    self.breaker.record_success()
+                    return resp
+                retryable = resp.status_code in RETRY_STATUSES
+                error = IntegrationError(
+                    self.name, f"HTTP {resp.status_code}: {resp.text[:200]}", status=resp.status_code, retryable=retryable
+                )
+                retry = retryable and (idempotent or resp.status_code in UNPROCESSED_STATUSES)
+                retry_after = resp.headers.get("Retry-After")
+            self.record(started, "error")
+            if error.status is not None and not error.retryable:
+                # The provider answered; a rejected request is not an outage.
+                self.breaker.record_success()
+                raise error
+            if not retry or attempt >= self.max_attempts:
+                self.breaker.record_failure()
+                raise error
+            with self._lock:
+                self.stats["retries"] += 1
+            time.sleep(self.backoff(attempt, retry_after))
+
+    def call(self, fn, *args, **kwargs):
+        """Run an SDK call that does its own HTTP under this provider's breaker and counters."""
+        self.breaker.before_call()
+        started = time.perf_counter()
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as exc:
+            self.record(started, "error")
+            status = getattr(exc, "http_status", None)
+            if status is not None and status < 500 and status != 429:
+                self.breaker.record_success()
+            else:
+                self.breaker.record_failure()
+            raise
+        self.record(started, "ok")
+        self.breaker.record_success()
+        return result
+
+
+PROVIDERS = {
+    "stripe": Provider("stripe", os.environ.get("STRIPE_API_BASE", "https://api.stripe.com"), read_timeout=30.0),
+    "resend": Provider(
+        "resend",
+        os.environ.get("RESEND_API_BASE", "https://api.resend.com"),
+        rate_per_second=float(os.environ.get("RESEND_RATE_PER_SECOND", "2")),
+    ),
+    "eztexting": Provider(
+        "eztexting",
+        os.environ.get("EZTEXTING_API_BASE", "https://a.eztexting.com/v1"),
+        rate_per_second=float(os.environ.get("EZTEXTING_RATE_PER_SECOND", "5")),
+    ),
+    "instagram": Provider(
+        "instagram", os.environ.get("INSTAGRAM_API_BASE", "https://graph.instagram.com"), read_timeout=5.0, max_attempts=2
+    ),
+}
+_stripe_clients = {}
+
+
+def provider(name):
+    return PROVIDERS[name]
+
+
+def set_observer(callback):
+    """Register ``callback(provider, seconds, outcome)``, called after every attempt."""
+    global _observer
+    _observer = callback
+
+
+def stats():
+    return {name: dict(p.stats, breaker=p.breaker.state) for name, p in PROVIDERS.items()}
+
+
+def stripe_client(api_key):
+    """One StripeClient per key, sharing the provider's pooled session.
+
+    The SDK retries network errors itself and adds idempotency keys to those
+    retries, so it gets the provider's retry budget instead of ``request``.
+    """
+    client = _stripe_clients.get(api_key)
+    if client is None:
+        import stripe
+
+        stripe_provider = PROVIDERS["stripe"]
+        client = stripe.StripeClient(
+            api_key,
+            base_addresses={"api": stripe_provider.base_url},
+            max_network_retries=stripe_provider.max_attempts - 1,
+            http_client=stripe.RequestsClient(timeout=stripe_provider.read_timeout, session=stripe_provider.session()),
+        )
+        _stripe_clients[api_key] = client
+    return client
@@ -86,6 +86,31 @@ document.addEventListener('DOMContentLoaded', () => {
         } else {
             setDateValue(new Date(dateInput.value));
         }
+        markFullDays();
+    };
+
+    const markFullDays = () => {
+        const dayButtons = calendarEl ? calendarEl.querySelectorAll('button.day[data-date]') : [];
+        if (!dayButtons.length) return;
+        const start = dayButtons[0].dataset.date;
+        const end = dayButtons[dayButtons.length - 1].dataset.date;
+        const params = new URLSearchParams({ start, end });
+        if (serviceSelect && serviceSelect.value) {
+            params.append('service_id', serviceSelect.value);
+        }
+        if (employeeSelect && employeeSelect.value) {
+            params.append('employee_id', employeeSelect.value);
+        }
+        fetch(`/api/availability/range?${params.toString()}`)
+            .then(r => r.json())
+            .then(data => {
+                if (!data.days) return;
+                dayButtons.forEach(button => {
+                    const info = data.days[button.dataset.date];
+                    button.classList.toggle('full', Boolean(info) && info.open === 0);
+                });
+            })
+            .catch(() => {});
     };
 
     const renderSlots = (data) => {
@@ -129,6 +154,9 @@ document.addEventListener('DOMContentLoaded', () => {
         if (!dateInput || !availabilityContainer) return;
         const params = new URLSearchParams();
         params.append('date', dateInput.value);
+        if (serviceSelect && serviceSelect.value) {
+            params.append('service_id', serviceSelect.value);
+        }
         if (employeeSelect && employeeSelect.value) {
             params.append('employee_id', employeeSelect.value);
         }
@@ -160,6 +188,7 @@ document.addEventListener('DOMContentLoaded', () => {
     }
     if (employeeSelect) {
         employeeSelect.addEventListener('change', fetchAvailability);
+        employeeSelect.addEventListener('change', markFullDays);
     }
     if (serviceSelect && serviceSelect.options.length && !serviceSelect.value) {
         serviceSelect.value = serviceSelect.options[0].value;
@@ -180,6 +209,8 @@ document.addEventListener('DOMContentLoaded', () => {
     }
     syncDepositCopy();
     serviceSelect?.addEventListener('change', syncDepositCopy);
+    serviceSelect?.addEventListener('change', fetchAvailability);
+    serviceSelect?.addEventListener('change', markFullDays);
     fetchAvailability();
 
     const adminNavToggle = document.querySelector('#admin-nav-toggle');
@@ -190,6 +221,58 @@ document.addEventListener('DOMContentLoaded', () => {
         });
     }
 
+    document.querySelectorAll('[data-client-search]').forEach(box => {
+        const input = box.querySelector('input');
+        const results = box.querySelector('.client-search-results');
+        let timer = null;
+        let controller = null;
+
+        const renderResults = (rows) => {
+            results.innerHTML = '';
+            if (!rows.length) {
+                const li = document.createElement('li');
+                li.className = 'muted small';
+                li.textContent = 'No matching clients.';
+                results.appendChild(li);
+            }
+            rows.forEach(row => {
+                const li = document.createElement('li');
+                const link = document.createElement('a');
+                link.href = row.url;
+                link.textContent = row.name;
+                const detail = document.createElement('span');
+                detail.className = 'muted small';
+                detail.textContent = [row.email, row.phone].filter(Boolean).join(' · ');
+                li.append(link, detail);
+                if (row.snippet && row.snippet !== row.name) {
+                    const snippet = document.createElement('span');
+                    snippet.className = 'muted small';
+                    snippet.textContent = row.snippet;
+                    li.appendChild(snippet);
+                }
+                results.appendChild(li);
+            });
+            results.hidden = false;
+        };
+
+        input.addEventListener('input', () => {
+            clearTimeout(timer);
+            const query = input.value.trim();
+            if (query.length < 2) {
+                results.hidden = true;
+                return;
+            }
+            timer = setTimeout(() => {
+                controller?.abort();
+                controller = new AbortController();
+                fetch(`/api/clients/search?${new URLSearchParams({ q: query })}`, { signal: controller.signal })
+                    .then(r => r.json())
+                    .then(data => renderResults(data.results || []))
+                    .catch(() => {});
+            }, 150);
+        });
+    });
+
     const filterButtons = document.querySelectorAll('.filter-btn[data-filter-category]');
     const serviceCards = document.querySelectorAll('#service-grid .service-card');
     const emptyState = document.querySelector('#no-services');